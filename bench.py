@@ -0,0 +1,341 @@
+# bench.py — offline replay benchmark for the hot path (no bot token needed)
+#
+#   python bench.py                      # run and compare against bench_baseline.json
+#   python bench.py --save-baseline      # run and store the numbers as the new baseline
+#   python bench.py --types 10,100 --messages 5000
+#   python bench.py --channels 100       # spread the live messages over 100 channels
+#
+# Replays synthetic hatch messages (embeds, fields, attachments, webhook ids)
+# through on_message -> per-channel ingest queues -> batched counting -> write-behind flush,
+# scans the same messages through a fake TextChannel whose history() yields
+# pages, and reports throughput, latency, counts_lock wait and DB commits.
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+# main.py reads its config at import time: load .env first so its values win
+# over the offline placeholders below (the bench only uses a temporary DB)
+load_dotenv()
+os.environ.setdefault("DISCORD_TOKEN", "offline-bench")
+os.environ.setdefault("CHANNEL_ID", "1")
+
+import discord
+import main
+
+BASELINE_PATH = "bench_baseline.json"
+PAGE_SIZE = 100
+
+# ---------------- SYNTHETIC MESSAGES ----------------
+class FakeAuthor:
+    def __init__(self, bot: bool):
+        self.bot = bot
+
+class FakeChannelRef:
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+
+class FakeAttachment:
+    def __init__(self, filename: str):
+        self.filename = filename
+
+class FakeMessage:
+    # just the attributes extract_text / on_message / the scanners read
+    def __init__(self, msg_id: int, created_at: datetime, content: str, embeds, attachments,
+                 webhook_id: Optional[int], channel_id: int):
+        self.id = msg_id
+        self.created_at = created_at
+        self.content = content
+        self.embeds = embeds
+        self.attachments = attachments
+        self.webhook_id = webhook_id
+        self.author = FakeAuthor(bot=False)
+        self.channel = FakeChannelRef(channel_id)
+
+def make_types(n: int) -> Dict[str, str]:
+    # the built-in types plus synthetic ones: mostly plain words like
+    # auto-detection creates, every 20th a custom regex like /egg_addtype
+    types = {name: rx.pattern for name, rx in main.PATTERN_MAP.items()}
+    i = 0
+    while len(types) < n:
+        name = f"bench{i}"
+        types[name] = rf"(?i)\b{name}\b" if i % 20 else rf"(?i)bench{i}(?:er)?s?"
+        i += 1
+    return types
+
+def make_messages(count: int, type_names: List[str], start: datetime, span: timedelta,
+                  seed: int = 1234, channels: int = 1) -> List[FakeMessage]:
+    rnd = random.Random(seed)
+    step = span / max(count, 1)
+    words = ["hatched", "a", "the", "rare", "shiny", "pet", "from", "lucky", "x2", "wow"]
+    out = []
+    for i in range(count):
+        created = start + step * i
+        eggs = [rnd.choice(type_names).replace("_", " ") for _ in range(rnd.randint(1, 3))]
+        embed = discord.Embed(title=f"{eggs[0].title()} Egg hatched!",
+                              description=" ".join(rnd.choice(words) for _ in range(8)))
+        embed.add_field(name="Egg", value=" ".join(eggs))
+        embed.add_field(name="Pet", value=rnd.choice(words))
+        if rnd.random() < 0.5:
+            embed.set_thumbnail(url=f"https://cdn.example/eggs/{eggs[-1].replace(' ', '_')}.png")
+        attachments = [FakeAttachment(f"{eggs[0].replace(' ', '_')}_{i}.png")] if rnd.random() < 0.2 else []
+        out.append(FakeMessage(
+            msg_id=discord.utils.time_snowflake(created) + i % 4096,
+            created_at=created,
+            content=rnd.choice(["", "", f"gg {eggs[0]}"]),
+            embeds=[embed],
+            attachments=attachments,
+            webhook_id=4242 if rnd.random() < 0.9 else None,
+            channel_id=main.CHANNEL_ID + i % channels,
+        ))
+    return out
+
+# ---------------- FAKE CHANNEL ----------------
+class FakeTextChannel:
+    """Stand-in TextChannel: history() honours after/before like discord.py
+    (datetimes or Objects, both exclusive) and yields PAGE_SIZE-message pages,
+    sleeping page_latency seconds per page to mimic the API round trip."""
+
+    def __init__(self, messages: List[FakeMessage], channel_id: int, page_latency: float = 0.0):
+        self.id = channel_id
+        self.messages = sorted(messages, key=lambda m: m.id)
+        self.page_latency = page_latency
+        self.pages = 0
+
+    async def history(self, limit=None, after=None, before=None, oldest_first=None):
+        if isinstance(after, datetime):
+            after = discord.Object(id=discord.utils.time_snowflake(after, high=True))
+        if isinstance(before, datetime):
+            before = discord.Object(id=discord.utils.time_snowflake(before, high=False))
+        selected = [m for m in self.messages
+                    if (after is None or m.id > after.id) and (before is None or m.id < before.id)]
+        if after is None:
+            selected.reverse()
+        if limit is not None:
+            selected = selected[:limit]
+        for i in range(0, len(selected), PAGE_SIZE):
+            self.pages += 1
+            if self.page_latency:
+                await asyncio.sleep(self.page_latency)
+            for m in selected[i:i + PAGE_SIZE]:
+                yield m
+
+# ---------------- INSTRUMENTATION ----------------
+class TimedLock(asyncio.Lock):
+    def __init__(self):
+        super().__init__()
+        self.wait_seconds = 0.0
+        self.acquisitions = 0
+
+    async def acquire(self):
+        t0 = time.perf_counter()
+        res = await super().acquire()
+        self.wait_seconds += time.perf_counter() - t0
+        self.acquisitions += 1
+        return res
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(round(pct / 100 * (len(vals) - 1))))]
+
+# ---------------- SCENARIOS ----------------
+async def bench_live(messages: List[FakeMessage], states: List["main.ChannelState"]) -> Dict[str, float]:
+    locks = [TimedLock() for _ in states]
+    saved_locks = [st.lock for st in states]
+    for st, lock in zip(states, locks):
+        st.lock = lock
+    commits = [0]
+    main._db_conn.set_trace_callback(lambda sql: sql.startswith("COMMIT") and commits.__setitem__(0, commits[0] + 1))
+
+    enqueued_at: Dict[int, float] = {}
+    done_latency: List[float] = []
+    process_batch = main._process_ingest_batch
+
+    async def timed_batch(st, items):
+        await process_batch(st, items)
+        now = time.perf_counter()
+        for item in items:
+            done_latency.append(now - enqueued_at.pop(item[0], now))
+
+    main._process_ingest_batch = timed_batch
+    flusher = asyncio.get_running_loop().create_task(main.persist_flush_task())
+    handler_latency: List[float] = []
+    try:
+        t0 = time.perf_counter()
+        for msg in messages:
+            t = time.perf_counter()
+            enqueued_at[msg.id] = t
+            await main.on_message(msg)
+            handler_latency.append(time.perf_counter() - t)
+            if len(handler_latency) % 50 == 0:
+                await asyncio.sleep(0)  # let the consumer run like gateway gaps would
+        while enqueued_at or any(not st.queue.empty() for st in states):
+            await asyncio.sleep(0.001)
+        await main.flush_pending_writes()
+        elapsed = time.perf_counter() - t0
+    finally:
+        flusher.cancel()
+        main._process_ingest_batch = process_batch
+        for st, lock in zip(states, saved_locks):
+            st.lock = lock
+        main._db_conn.set_trace_callback(None)
+
+    return {
+        "live_msgs_per_sec": len(messages) / elapsed,
+        "handler_p50_us": percentile(handler_latency, 50) * 1e6,
+        "handler_p99_us": percentile(handler_latency, 99) * 1e6,
+        "ingest_p50_ms": percentile(done_latency, 50) * 1e3,
+        "ingest_p99_ms": percentile(done_latency, 99) * 1e3,
+        "lock_wait_ms": sum(lock.wait_seconds for lock in locks) * 1e3,
+        "db_commits_per_msg": commits[0] / len(messages),
+    }
+
+async def bench_extract(messages: List[FakeMessage]) -> Dict[str, float]:
+    t0 = time.perf_counter()
+    for msg in messages:
+        main.count_hits(main.extract_text(msg))
+    return {"match_msgs_per_sec": len(messages) / (time.perf_counter() - t0)}
+
+async def bench_scan(messages: List[FakeMessage], page_latency: float) -> Dict[str, float]:
+    channel = FakeTextChannel(messages, main.CHANNEL_ID, page_latency)
+    since = messages[0].created_at - timedelta(seconds=1)
+    before = messages[-1].created_at + timedelta(seconds=1)
+    t0 = time.perf_counter()
+    await main.fast_count_all(channel, since, before)
+    elapsed = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    await main.range_totals(channel, since, before)  # cold: back-fills the index
+    cold = time.perf_counter() - t1
+    t2 = time.perf_counter()
+    await main.range_totals(channel, since, before)  # warm: rollups + index only
+    warm = time.perf_counter() - t2
+    return {
+        "scan_msgs_per_sec": len(messages) / elapsed,
+        "scan_pages": channel.pages,
+        "range_cold_ms": cold * 1e3,
+        "range_warm_ms": warm * 1e3,
+    }
+
+async def run_for_types(n_types: int, n_messages: int, page_latency: float, n_channels: int = 1) -> Dict[str, float]:
+    types = make_types(n_types)
+    added = [name for name in types if name not in main.PATTERN_MAP]
+    for name in added:
+        main.register_pattern(name, main.re.compile(types[name]))
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            main.DB_PATH = os.path.join(tmp, "bench.db")
+            await main.db_init()
+            try:
+                states = [await main.attach_channel(1, main.CHANNEL_ID + i) for i in range(n_channels)]
+                await main.resync_channels(states)  # what on_ready does: open the live ranges
+                now = datetime.now(timezone.utc)
+                live = make_messages(n_messages, list(types), now - timedelta(minutes=30), timedelta(minutes=29),
+                                     channels=n_channels)
+                history = make_messages(n_messages, list(types), now - timedelta(days=14), timedelta(days=13), seed=99)
+                results = {"types": len(types), "channels": n_channels, "messages": n_messages}
+                results.update(await bench_extract(live))
+                results.update(await bench_live(live, states))
+                results.update(await bench_scan(history, page_latency))
+                return results
+            finally:
+                for st in main._channels.values():
+                    st.ingest_task.cancel()
+                main._channels.clear()
+                await main.db_close()
+    finally:
+        for name in added:
+            main.unregister_pattern(name)
+        main.shutdown_match_pool()
+
+# ---------------- REPORT / BASELINE ----------------
+# metric -> True when higher is better
+METRICS = {
+    "match_msgs_per_sec": True,
+    "live_msgs_per_sec": True,
+    "handler_p50_us": False,
+    "handler_p99_us": False,
+    "ingest_p50_ms": False,
+    "ingest_p99_ms": False,
+    "lock_wait_ms": False,
+    "db_commits_per_msg": False,
+    "scan_msgs_per_sec": True,
+    "range_warm_ms": False,
+}
+
+def _fmt(v) -> str:
+    if isinstance(v, float):
+        return f"{v:>18.4f}" if v < 1 else f"{v:>18.2f}"
+    return f"{v:>18}"
+
+def print_report(rows: List[Dict[str, float]]):
+    cols = ["types", "channels", "messages"] + list(METRICS) + ["scan_pages", "range_cold_ms"]
+    print(" | ".join(f"{c:>18}" for c in cols))
+    for row in rows:
+        print(" | ".join(_fmt(row.get(c, 0)) for c in cols))
+
+def baseline_key(row: Dict[str, float]) -> str:
+    return str(row["types"]) + (f"x{row['channels']}" if row.get("channels", 1) > 1 else "")
+
+def compare(rows: List[Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    regressions = []
+    for row in rows:
+        base = baseline.get(baseline_key(row))
+        if not base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base.get(metric), row.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+                regressions.append(f"{row['types']} types: {metric} {old:.2f} -> {new:.2f} ({change:+.0%})")
+    return regressions
+
+async def amain(args) -> int:
+    main.client.loop = asyncio.get_running_loop()  # auto-detect schedules re-index tasks on it
+    rows = []
+    for n in args.types:
+        rows.append(await run_for_types(n, args.messages, args.page_latency, args.channels))
+    print_report(rows)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({baseline_key(r): r for r in rows}, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f), args.tolerance)
+        if regressions:
+            print("REGRESSIONS (tolerance {:.0%}):".format(args.tolerance))
+            for r in regressions:
+                print("  " + r)
+            return 1
+        print(f"No regressions vs {args.baseline}")
+    return 0
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Offline egg counter benchmark")
+    ap.add_argument("--types", type=lambda s: [int(x) for x in s.split(",")], default=[10, 100, 1000],
+                    help="comma separated pattern counts (default 10,100,1000)")
+    ap.add_argument("--messages", type=int, default=5000, help="messages per scenario")
+    ap.add_argument("--channels", type=int, default=1, help="tracked channels the live messages are spread over")
+    ap.add_argument("--page-latency", type=float, default=0.0, help="fake API seconds per history page")
+    ap.add_argument("--baseline", default=BASELINE_PATH)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    return ap.parse_args(argv)
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(amain(parse_args())))
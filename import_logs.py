@@ -0,0 +1,261 @@
+# import_logs.py — bulk import of exported channel logs into egg_counts_daily
+#
+#   python import_logs.py export.json [more.json ...]
+#   python import_logs.py export.json --workers 8 --replace
+#   python import_logs.py export.json --dry-run
+#   python import_logs.py export.json --channel 123456789012345678
+#
+# Reads DiscordChatExporter-style JSON ({"messages": [...]} or a bare array).
+# Files are streamed: each message object's span is found in 1 MiB chunks,
+# the raw spans are parsed and matched in a process pool (same pattern
+# set as the bot, loaded from egg_types), and per-day totals are bucketed like
+# the daily report (local_midnight). Memory stays flat however large the file.
+# Counts follow the history scan rules: every message, ONLY_WEBHOOK respected.
+#
+# Totals are stored for --channel (default: the first tracked channel from
+# .env; required when none is configured).
+# Dates that already have rows for it in egg_counts_daily are left alone unless
+# --replace is given, so re-running an import never double counts, and today
+# (still counted live) is skipped. Set KEEP_DAILY_DAYS=0 to keep old days.
+
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Tuple
+
+from dotenv import load_dotenv
+
+# main.py reads its config at import time: load .env first so its values win
+# over the offline placeholder below
+load_dotenv()
+os.environ.setdefault("DISCORD_TOKEN", "offline-import")
+if not (os.environ.get("CHANNEL_IDS") or os.environ.get("CHANNEL_ID")):
+    # no bot config: --channel is required, and is also the channel rows of a
+    # legacy eggs.db are assigned to when it gets migrated
+    _pre = argparse.ArgumentParser(add_help=False)
+    _pre.add_argument("--channel", type=int)
+    _channel = _pre.parse_known_args()[0].channel
+    if _channel is None:
+        sys.exit("CHANNEL_ID is not set (.env or environment): pass --channel")
+    os.environ["CHANNEL_ID"] = str(_channel)
+
+import main
+
+CHUNK_CHARS = 1 << 20
+BATCH_MESSAGES = 2000
+
+# ---------------- STREAMING ----------------
+# The parent only delimits message objects: raw_decode (C speed) finds where
+# each one ends in the current chunk and the raw text goes to a worker, which
+# parses it again and does the expensive part (text extraction + matching).
+_MESSAGES_RX = re.compile(r'"messages"\s*:\s*\[')
+_SKIP_RX = re.compile(r'[\s,]*')
+
+def iter_message_spans(path: str) -> Iterator[str]:
+    """Yield the raw JSON text of each message object, reading CHUNK_CHARS at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buf = f.read(CHUNK_CHARS)
+        # find the messages array: either the top-level value or the "messages" key
+        while True:
+            stripped = buf.lstrip("\ufeff \t\r\n")
+            if stripped.startswith("["):
+                pos = len(buf) - len(stripped) + 1
+                break
+            m = _MESSAGES_RX.search(buf)
+            if m:
+                pos = m.end()
+                break
+            more = f.read(CHUNK_CHARS)
+            if not more:
+                return
+            buf = buf[-64:] + more  # keep enough for a key split across chunks
+
+        while True:
+            pos = _SKIP_RX.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return  # end of the messages array
+            try:
+                _, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                # object cut by the chunk boundary: read on and retry
+                more = f.read(CHUNK_CHARS)
+                if not more:
+                    if pos < len(buf):
+                        raise
+                    return
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield buf[pos:end]
+            pos = end
+
+def iter_batches(paths: List[str]) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for path in paths:
+        for span in iter_message_spans(path):
+            batch.append(span)
+            if len(batch) >= BATCH_MESSAGES:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# ---------------- PARSING + MATCHING (worker processes) ----------------
+def extract_export_text(m: dict) -> str:
+    # extract_text for the exported message shape
+    parts = []
+    if m.get("content"):
+        parts.append(m["content"])
+    for e in m.get("embeds") or ():
+        if e.get("title"): parts.append(e["title"])
+        if e.get("description"): parts.append(e["description"])
+        for fld in e.get("fields") or ():
+            if fld.get("name"): parts.append(fld["name"])
+            if fld.get("value"): parts.append(fld["value"])
+        for key in ("image", "thumbnail"):
+            url = (e.get(key) or {}).get("url")
+            if url:
+                parts.append(url.split("/")[-1])
+    for a in m.get("attachments") or ():
+        name = a.get("fileName") or a.get("filename")
+        if name:
+            parts.append(name)
+    return " ".join(parts)
+
+def _is_webhook(m: dict) -> bool:
+    if m.get("webhookId") or m.get("webhook_id"):
+        return True
+    author = m.get("author") or {}
+    # the exporter has no webhook flag; webhook authors are bots with discriminator 0000
+    return bool(author.get("isBot")) and author.get("discriminator") == "0000"
+
+def _import_worker_batch(spans: List[str]) -> Tuple[Dict[Tuple[str, str], int], int, int]:
+    # -> ({(date, egg_type): count}, messages parsed, messages skipped)
+    totals: Dict[Tuple[str, str], int] = {}
+    days: Dict[int, str] = {}
+    skipped = 0
+    for span in spans:
+        try:
+            m = json.loads(span)
+            ts = datetime.fromisoformat(m["timestamp"].replace("Z", "+00:00"))
+        except (ValueError, KeyError, TypeError):
+            skipped += 1
+            continue
+        if main.ONLY_WEBHOOK and not _is_webhook(m):
+            continue
+        hits = main.count_hits(extract_export_text(m))
+        if not hits:
+            continue
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        minute = int(ts.timestamp()) // 60  # local days start on a whole minute
+        day = days.get(minute)
+        if day is None:
+            # the key daily_report_task uses: UTC date of the local midnight
+            day = days[minute] = main.local_midnight(ts.astimezone(timezone.utc)).date().isoformat()
+        for name, n in hits.items():
+            totals[(day, name)] = totals.get((day, name), 0) + n
+    return totals, len(spans) - skipped, skipped
+
+# ---------------- IMPORT ----------------
+def load_patterns(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    rows = conn.execute("SELECT id, name, pattern FROM egg_types").fetchall()
+    main.adopt_type_ids([(tid, name) for tid, name, _ in rows])
+    for _, name, pattern in rows:
+        try:
+            main.register_pattern(name, re.compile(pattern))
+        except re.error:
+            print("Invalid regex in DB for", name)
+    # built-in types the bot hasn't stored yet need their ids in egg_types
+    stored = {name for _, name, _ in rows}
+    with conn:
+        conn.executemany(main._UPSERT_TYPE, [(main.type_id(n), n, rx.pattern, main.EGG_EMOJIS.get(n))
+                                             for n, rx in main.PATTERN_MAP.items() if n not in stored])
+    return [(n, rx.pattern) for n, rx in main.PATTERN_MAP.items()]
+
+def run_import(paths: List[str], db_path: str, workers: int, replace: bool, dry_run: bool,
+               channel_id: int = main.CHANNEL_ID) -> int:
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    main._create_tables(conn)
+    patterns = load_patterns(conn)
+
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    totals: Dict[Tuple[str, str], int] = {}
+    parsed = skipped = 0
+    t0 = last_report = time.perf_counter()
+
+    def merge(result):
+        nonlocal parsed, skipped
+        part, n_ok, n_bad = result
+        for key, n in part.items():
+            totals[key] = totals.get(key, 0) + n
+        parsed += n_ok
+        skipped += n_bad
+
+    # bounded in-flight window: the reader never runs more than 2 batches per worker ahead
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=main._match_worker_init, initargs=(patterns,)) as pool:
+        inflight = deque()
+        for batch in iter_batches(paths):
+            if len(inflight) >= workers * 2:
+                merge(inflight.popleft().result())
+            inflight.append(pool.submit(_import_worker_batch, batch))
+            now = time.perf_counter()
+            if now - last_report >= 5:
+                last_report = now
+                print(f"  {parsed} messages, {parsed / (now - t0):.0f} msg/s", file=sys.stderr)
+        while inflight:
+            merge(inflight.popleft().result())
+    elapsed = time.perf_counter() - t0
+
+    today = main.local_midnight(datetime.now(timezone.utc)).date().isoformat()
+    existing = {d for (d,) in conn.execute("SELECT DISTINCT date FROM egg_counts_daily WHERE channel_id = ?",
+                                           (channel_id,))}
+    rows = [(channel_id, d, main.type_id(name), n) for (d, name), n in sorted(totals.items())
+            if d < today and (replace or d not in existing)]
+    dates = sorted({r[1] for r in rows})
+    kept = sorted({d for d, _ in totals} - set(dates))
+
+    print(f"Parsed {parsed} messages ({skipped} unreadable) from {total_bytes / 1e6:.1f} MB "
+          f"in {elapsed:.1f}s ({parsed / elapsed if elapsed else 0:.0f} msg/s, "
+          f"{total_bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s)")
+    print(f"{len(dates)} days to write" + (f", {len(kept)} skipped (today or already present)" if kept else ""))
+    if dates and main.KEEP_DAILY_DAYS:
+        print(f"Note: days older than KEEP_DAILY_DAYS={main.KEEP_DAILY_DAYS} are removed by the nightly retention")
+    if dry_run or not rows:
+        conn.close()
+        return 0
+
+    with conn:
+        if replace:
+            conn.executemany("DELETE FROM egg_counts_daily WHERE channel_id = ? AND date = ?",
+                             [(channel_id, d) for d in dates])
+        conn.executemany("INSERT OR REPLACE INTO egg_counts_daily(channel_id, date, type_id, count) VALUES(?, ?, ?, ?)",
+                         rows)
+    conn.close()
+    print(f"Wrote {len(rows)} rows to egg_counts_daily")
+    return 0
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Import exported channel logs into egg_counts_daily")
+    ap.add_argument("paths", nargs="+", help="JSON export files")
+    ap.add_argument("--db", default=main.DB_PATH)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--channel", type=int, default=main.CHANNEL_ID, help="channel id the totals belong to")
+    ap.add_argument("--replace", action="store_true", help="overwrite days already in the database")
+    ap.add_argument("--dry-run", action="store_true", help="parse and report, write nothing")
+    return ap.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(run_import(args.paths, args.db, max(1, args.workers), args.replace, args.dry_run, args.channel))
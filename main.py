@@ -5,7 +5,21 @@ import os
 import re
 import sqlite3
 import asyncio
-from typing import Optional, Dict, Tuple
+import queue
+import threading
+import time
+import functools
+import contextlib
+from collections import OrderedDict
+import hashlib
+import json
+import multiprocessing
+import operator
+from itertools import accumulate
+from array import array
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Optional, Dict, List, Tuple
 from datetime import datetime, timedelta, timezone
 
 import discord
@@ -16,14 +30,83 @@ load_dotenv()
 
 # ---------------- CONFIG ----------------
 TOKEN = os.environ["DISCORD_TOKEN"]
-CHANNEL_ID = int(os.environ["CHANNEL_ID"])
-GUILD_ID = int(os.environ["GUILD_ID"])
+GUILD_ID = int(os.environ.get("GUILD_ID") or 0)  # commands are synced to this guild; empty/0 = globally
+
+def _parse_channels(spec: str) -> List[Tuple[int, int]]:
+    # "guild_id:channel_id,..." -> [(guild_id, channel_id)]; a bare channel id
+    # belongs to GUILD_ID, or (0) to whichever guild the gateway reports for it
+    out = []
+    for part in spec.replace(" ", "").split(","):
+        if part:
+            guild, _, channel = part.rpartition(":")
+            out.append((int(guild) if guild else GUILD_ID, int(channel)))
+    return out
+
+# tracked channels: CHANNEL_IDS, or the single CHANNEL_ID
+CHANNELS = _parse_channels(os.environ.get("CHANNEL_IDS") or os.environ["CHANNEL_ID"])
+CHANNEL_ID = CHANNELS[0][1]  # rows stored before per-channel tables belong to it
+# sharding: SHARD_COUNT (a number or "auto") runs an AutoShardedClient. SHARD_IDS
+# picks this process's shards (needs a number); only channels of guilds on
+# those shards are tracked here
+_shard_count = (os.environ.get("SHARD_COUNT") or "").strip().lower()
+SHARDED = bool(_shard_count)
+SHARD_COUNT = None if _shard_count in ("", "auto") else int(_shard_count)
+SHARD_IDS = [int(x) for x in (os.environ.get("SHARD_IDS") or "").split(",") if x.strip()] or None
+if SHARD_IDS is not None and not (SHARD_COUNT and all(0 <= i < SHARD_COUNT for i in SHARD_IDS)):
+    raise SystemExit("SHARD_IDS needs a numeric SHARD_COUNT (not auto) and ids below it")
 REPORT_USER_ID = int(os.environ.get("REPORT_USER_ID", "781091697106223104"))
+# egg types are shared by every tracked channel: only admins of this guild may
+# change them or see process-wide stats (default: GUILD_ID, else the first
+# tracked channel's guild)
+ADMIN_GUILD_ID = int(os.environ.get("ADMIN_GUILD_ID") or 0) or GUILD_ID or CHANNELS[0][0]
 
 ONLY_WEBHOOK = os.environ.get("ONLY_WEBHOOK", "0") == "1"
+# keep message text in the index (for /egg_addtype re-indexing) for KEEP_DAYS;
+# with ONLY_WEBHOOK only webhook messages keep theirs
+INDEX_TEXT = os.environ.get("INDEX_TEXT", "1") == "1"
 TZ_OFFSET = float(os.environ.get("TZ_OFFSET_HOURS", "5.5"))  # e.g. 5.5
 RESET_AFTER_REPORT = True
 KEEP_DAYS = 14
+# daily totals are tiny; keep them longer (0 = forever) so imported history survives
+KEEP_DAILY_DAYS = int(os.environ.get("KEEP_DAILY_DAYS", str(KEEP_DAYS)))
+# write-behind for live counters: at most PERSIST_FLUSH_SECONDS of counts (or
+# PERSIST_MAX_DIRTY dirty types, whichever comes first) can be lost on a crash
+PERSIST_FLUSH_SECONDS = float(os.environ.get("PERSIST_FLUSH_SECONDS", "5"))
+PERSIST_MAX_DIRTY = int(os.environ.get("PERSIST_MAX_DIRTY", "50"))
+# auto-detected egg types are only added after this many sightings (messages);
+# at most AUTO_TYPE_MAX_CANDIDATES unconfirmed names are tracked, least recent dropped
+AUTO_TYPE_MIN_SIGHTINGS = int(os.environ.get("AUTO_TYPE_MIN_SIGHTINGS", "3"))
+AUTO_TYPE_MAX_CANDIDATES = int(os.environ.get("AUTO_TYPE_MAX_CANDIDATES", "1000"))
+# history scans: up to SCAN_MAX_WORKERS concurrent fetchers over snowflake slices
+SCAN_MAX_WORKERS = int(os.environ.get("SCAN_MAX_WORKERS", "4"))
+SCAN_MIN_SLICE_SECONDS = 15 * 60
+SCAN_THROTTLE_SECONDS = 1.0  # a page slower than this was rate limited
+# optional: match scanned text in worker processes (0 = on the event loop)
+SCAN_PROCESS_WORKERS = int(os.environ.get("SCAN_PROCESS_WORKERS", "0"))
+SCAN_PROCESS_BATCH = 500
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "60"))
+# in-memory per-minute ring buffer answering rolling windows up to this many hours
+WINDOW_HOURS = 48
+# instrumentation: off by default; when on, Prometheus text on METRICS_HOST:METRICS_PORT
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+DB_READERS = int(os.environ.get("DB_READERS", "3"))
+DB_WRITE_BATCH = 64        # max queued write jobs committed in one transaction
+DB_CACHED_STATEMENTS = 256  # per-connection prepared statement cache
+# retention: bounded delete chunks, idle-time incremental vacuum + WAL checkpoints
+RETENTION_CHUNK = 500
+RETENTION_VACUUM_PAGES = 256
+RETENTION_STEP_SECONDS = 30
+RETENTION_WAL_MAX_BYTES = 64 * 1024 * 1024
+# live ingest: on_message only enqueues; a consumer counts micro-batches.
+# INGEST_DROP_POLICY when full: block (backpressure), drop_newest, drop_oldest
+INGEST_QUEUE_MAX = int(os.environ.get("INGEST_QUEUE_MAX", "10000"))
+INGEST_BATCH_MAX = int(os.environ.get("INGEST_BATCH_MAX", "200"))
+INGEST_DROP_POLICY = os.environ.get("INGEST_DROP_POLICY", "block")
+# hits of this many recent messages stay in memory for edit/delete corrections;
+# older messages are looked up in the message index
+EDIT_CACHE_SIZE = int(os.environ.get("EDIT_CACHE_SIZE", "20000"))
 
 DB_PATH = "eggs.db"
 
@@ -62,112 +145,779 @@ EGG_EMOJIS: Dict[str, str] = {
 
 AUTO_EMOJI_POOL = ["💠","🔮","✨","💎","🧿","🪄","🪙","🔹","🔸","🌟","🥚"]
 EMBED_COLOR = 0x00FF88
+
+# ---------------- COMBINED MATCHER ----------------
+# Plain "(?i)\bword\b" patterns (the defaults + every auto-detected type) can
+# only ever match a whole \w+ token, so they are answered from ONE token scan
+# with a dict lookup per token. Anything else (custom /egg_addtype regexes,
+# "anti ?bee", ...) keeps its own findall so counts stay identical to running
+# every pattern separately, overlaps included.
+_PLAIN_PATTERN_RX = re.compile(r"\(\?i\)\\b([A-Za-z0-9_]+)\\b")
+_TOKEN_RX = re.compile(r"\w+")
+
+_keyword_types: Dict[str, List[str]] = {}    # lowercased word -> type names
+_fallback_types: Dict[str, re.Pattern] = {}  # type name -> own regex
+_keyword_fold_rx: Optional[re.Pattern] = None  # for non-ascii tokens, built lazily
+_keyword_fold_words: List[str] = []
+
+def _plain_word(rx: re.Pattern) -> Optional[str]:
+    if not isinstance(rx.pattern, str) or rx.flags & ~(re.IGNORECASE | re.UNICODE):
+        return None
+    m = _PLAIN_PATTERN_RX.fullmatch(rx.pattern)
+    return m.group(1).lower() if m else None
+
+def matcher_add(name: str, rx: re.Pattern):
+    global _keyword_fold_rx
+    matcher_remove(name)
+    word = _plain_word(rx)
+    if word is None:
+        _fallback_types[name] = rx
+        return
+    _keyword_types.setdefault(word, []).append(name)
+    _keyword_fold_rx = None
+
+def matcher_remove(name: str):
+    global _keyword_fold_rx
+    if _fallback_types.pop(name, None) is not None:
+        return
+    for word, names in list(_keyword_types.items()):
+        if name in names:
+            names.remove(name)
+            if not names:
+                del _keyword_types[word]
+            _keyword_fold_rx = None
+            return
+
+def rebuild_matcher():
+    global _keyword_fold_rx
+    _keyword_types.clear()
+    _fallback_types.clear()
+    _keyword_fold_rx = None
+    for name, rx in PATTERN_MAP.items():
+        matcher_add(name, rx)
+
+_pattern_version = 0  # bumped on every change; match pool workers follow it
+
+def register_pattern(name: str, rx: re.Pattern):
+    global _pattern_version
+    PATTERN_MAP[name] = rx
+    matcher_add(name, rx)
+    type_id(name)
+    _pattern_version += 1
+
+def unregister_pattern(name: str):
+    global _pattern_version
+    PATTERN_MAP.pop(name, None)
+    matcher_remove(name)
+    _pattern_version += 1
+
+def _fold_token(tok: str) -> Optional[str]:
+    # non-ascii tokens can still hit an ascii keyword under (?i) (e.g. "ſafari"),
+    # so ask the regex engine instead of str.lower()
+    global _keyword_fold_rx, _keyword_fold_words
+    if _keyword_fold_rx is None:
+        _keyword_fold_words = list(_keyword_types.keys())
+        alts = "|".join(f"(?P<k{i}>{w})" for i, w in enumerate(_keyword_fold_words))
+        _keyword_fold_rx = re.compile(f"(?i)(?:{alts})")
+    m = _keyword_fold_rx.fullmatch(tok)
+    return _keyword_fold_words[int(m.lastgroup[1:])] if m else None
+
+def count_hits(text: str) -> Dict[str, int]:
+    """Per-type hit counts for text (only types with hits), one pass for keywords."""
+    hits: Dict[str, int] = {}
+    if _keyword_types:
+        kw = _keyword_types
+        for tok in _TOKEN_RX.findall(text):
+            names = kw.get(tok.lower() if tok.isascii() else _fold_token(tok))
+            if names:
+                for name in names:
+                    hits[name] = hits.get(name, 0) + 1
+    for name, rx in _fallback_types.items():
+        n = len(rx.findall(text))
+        if n:
+            hits[name] = n
+    return hits
+
+# ---------------- TYPE IDS ----------------
+# Every egg type has a stable integer id (egg_types.id). Count tables are keyed
+# by it and live counters are arrays indexed by it, so a report snapshot is one
+# array copy and each type costs 8 bytes per counter. New ids are handed out
+# here (max + 1) and stored with the type; load_persisted_types adopts the ids
+# already in the database.
+_type_ids: Dict[str, int] = {}
+_type_names: List[Optional[str]] = [None]  # id -> name; ids start at 1 like rowids
+
+def type_id(name: str) -> int:
+    tid = _type_ids.get(name)
+    if tid is None:
+        tid = _type_ids[name] = len(_type_names)
+        _type_names.append(name)
+    return tid
+
+def type_name(tid: int) -> Optional[str]:
+    return _type_names[tid] if 0 < tid < len(_type_names) else None
+
+class TypeCounters:
+    """Counters in an array('q') indexed by type id. Reads by name and iteration
+    follow PATTERN_MAP, so removed types drop out without reshaping the array."""
+    __slots__ = ("vals",)
+
+    def __init__(self, vals: Optional[array] = None):
+        self.vals = vals if vals is not None else array("q")
+
+    def _slot(self, name: str) -> int:
+        tid = type_id(name)
+        if tid >= len(self.vals):
+            self.vals.frombytes(bytes(8 * (tid + 1 - len(self.vals))))
+        return tid
+
+    def add(self, name: str, n: int) -> int:
+        tid = self._slot(name)
+        self.vals[tid] += n
+        return self.vals[tid]
+
+    def get(self, name: str, default: int = 0) -> int:
+        tid = _type_ids.get(name)
+        return self.vals[tid] if tid is not None and tid < len(self.vals) else default
+
+    def __getitem__(self, name: str) -> int:
+        return self.get(name)
+
+    def __setitem__(self, name: str, value: int):
+        self.vals[self._slot(name)] = value
+
+    def __contains__(self, name: str) -> bool:
+        return name in PATTERN_MAP
+
+    def pop(self, name: str, default: Optional[int] = None) -> Optional[int]:
+        value = self.get(name, default)
+        tid = _type_ids.get(name)
+        if tid is not None and tid < len(self.vals):
+            self.vals[tid] = 0
+        return value
+
+    def keys(self) -> List[str]:
+        return list(PATTERN_MAP)
+
+    def values(self) -> List[int]:
+        return [self.get(n) for n in PATTERN_MAP]
+
+    def items(self) -> List[Tuple[str, int]]:
+        return [(n, self.get(n)) for n in PATTERN_MAP]
+
+    def copy(self) -> "TypeCounters":
+        return TypeCounters(array("q", self.vals))
+
+    def zero(self):
+        self.vals = array("q", bytes(8 * len(self.vals)))
+
+rebuild_matcher()
+
+# ---------------- METRICS ----------------
+# Counters and timers for the hot path. With METRICS_ENABLED off, @timed
+# returns the function untouched and every other call site is behind an
+# `if METRICS_ENABLED:` check, so the disabled cost is one global lookup.
+_metric_counters: Dict[str, float] = {}
+_metric_timers: Dict[str, List[float]] = {}  # name -> [count, sum, max] seconds
+_metric_lock = threading.Lock()  # the DB writer thread records too
+
+def metric_inc(name: str, n: float = 1):
+    with _metric_lock:
+        _metric_counters[name] = _metric_counters.get(name, 0) + n
+
+def metric_time(name: str, seconds: float):
+    with _metric_lock:
+        t = _metric_timers.get(name)
+        if t is None:
+            _metric_timers[name] = [1, seconds, seconds]
+        else:
+            t[0] += 1
+            t[1] += seconds
+            if seconds > t[2]:
+                t[2] = seconds
+
+def timed(name: str):
+    def deco(fn):
+        if not METRICS_ENABLED:
+            return fn
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                metric_time(name, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+class _TimedLock(asyncio.Lock):
+    # records how long callers wait for the lock and how long it is held
+    def __init__(self, name: str):
+        super().__init__()
+        self._name = name
+        self._acquired_at = 0.0
+
+    async def acquire(self):
+        t0 = time.perf_counter()
+        res = await super().acquire()
+        self._acquired_at = time.perf_counter()
+        metric_time(self._name + "_wait", self._acquired_at - t0)
+        return res
+
+    def release(self):
+        metric_time(self._name + "_held", time.perf_counter() - self._acquired_at)
+        super().release()
+
+# stats values that can go down (maxima since the last run, durations, flags);
+# every other numeric stat is a monotonic counter
+_GAUGE_STATS = {"ingest_max_depth", "retention_lock_ms_max",
+                "startup_setup_s", "startup_ready_s", "startup_sync_s", "startup_synced"}
+
+def render_metrics() -> str:
+    lines = []
+    with _metric_lock:
+        timers = {k: list(v) for k, v in _metric_timers.items()}
+        counters = dict(_metric_counters)
+    for name, (count, total, mx) in sorted(timers.items()):
+        lines += [f"# TYPE egg_{name}_seconds summary",
+                  f"egg_{name}_seconds_count {count}",
+                  f"egg_{name}_seconds_sum {total:.6f}",
+                  f"# TYPE egg_{name}_seconds_max gauge",
+                  f"egg_{name}_seconds_max {mx:.6f}"]
+    for prefix, stats in (("", counters), ("query_cache_", query_cache_stats),
+                          ("ingest_", ingest_stats), ("retention_", retention_stats),
+                          ("startup_", startup_stats)):
+        for key, val in sorted(stats.items()):
+            if not isinstance(val, (int, float)):
+                continue
+            name = prefix + key
+            if name in _GAUGE_STATS:
+                lines += [f"# TYPE egg_{name} gauge", f"egg_{name} {val}"]
+            else:
+                name = name if name.endswith("_total") else name + "_total"
+                lines += [f"# TYPE egg_{name} counter", f"egg_{name} {val}"]
+    gauges = {
+        "channels": len(_channels),
+        "ingest_queue_depth": sum(st.queue.qsize() for st in _channels.values()),
+        "db_write_queue_depth": _db_write_queue.qsize(),
+        "db_reads_in_flight": _db_reads_in_flight,
+        "dirty_counters": sum(len(st.dirty) for st in _channels.values()),
+        "index_rows_pending": sum(len(st.index_pending) for st in _channels.values()),
+        "egg_types": len(PATTERN_MAP),
+        "query_cache_entries": len(_query_cache),
+    }
+    for key, val in gauges.items():
+        lines += [f"# TYPE egg_{key} gauge", f"egg_{key} {val}"]
+    return "\n".join(lines) + "\n"
+
+_metrics_runner = None
+
+async def start_metrics_server():
+    # aiohttp ships with discord.py
+    global _metrics_runner
+    if not METRICS_ENABLED or _metrics_runner is not None:
+        return
+    from aiohttp import web
+    async def _handle(request):
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    _metrics_runner = web.AppRunner(app)
+    await _metrics_runner.setup()
+    await web.TCPSite(_metrics_runner, METRICS_HOST, METRICS_PORT).start()
+    print(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+async def stop_metrics_server():
+    global _metrics_runner
+    if _metrics_runner is not None:
+        await _metrics_runner.cleanup()
+        _metrics_runner = None
+
 # ---------------- DISCORD SETUP ----------------
 intents = discord.Intents.default()
 intents.message_content = True
-client = discord.Client(intents=intents)
+if SHARDED:
+    client = discord.AutoShardedClient(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    client = discord.Client(intents=intents)
 tree = app_commands.CommandTree(client)
 
-# in-memory live counters (persisted to DB periodically / on update)
-egg_counts: Dict[str, int] = {name: 0 for name in PATTERN_MAP.keys()}
-counts_lock = asyncio.Lock()
-
-# DB connection + locks
+# DB: one writer thread owns _db_conn; reads use a pool of read-only WAL connections
 _db_conn: Optional[sqlite3.Connection] = None
-_db_lock = asyncio.Lock()
+_db_write_queue: "queue.Queue" = queue.Queue()
+_db_writer: Optional[threading.Thread] = None
+_db_read_pool: Optional[ThreadPoolExecutor] = None
+_db_read_local = threading.local()
+_db_read_conns: List[sqlite3.Connection] = []
+_db_reads_in_flight = 0
+
+# ---------------- CHANNEL STATE ----------------
+# Everything live tracking keeps is per tracked channel: counters, lock,
+# write-behind entries, coverage range, live-hit tally, minute ring, ingest
+# queue and backfill job. A message only touches its own channel's state, so
+# channels never wait on each other and per-message cost doesn't grow with the
+# number of channels; only the DB writer thread is shared. Egg types (patterns,
+# ids, emojis) stay global: every channel counts the same types. A process
+# only creates states for the guilds on its own shards.
+class ChannelState:
+    def __init__(self, guild_id: int, channel_id: int):
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        # in-memory live counters (persisted to DB periodically / on update)
+        self.counts = TypeCounters()
+        self.lock = _TimedLock("counts_lock") if METRICS_ENABLED else asyncio.Lock()
+        self.dirty: Dict[int, int] = {}  # type id -> count
+        self.index_pending: List[Tuple[int, float, int, str, Dict[str, int]]] = []
+        self.range_id: Optional[int] = None  # coverage row of the live session
+        self.live_hits: Dict[str, int] = {}  # monotonic, same webhook filter as the index
+        self.win_counts: Dict[int, array] = {}  # type id -> minute ring, types seen only
+        self.win_head = 0  # newest minute currently in the ring
+        self.win_valid_since = float("inf")
+        self.queue: "asyncio.Queue[Tuple[int, float, int, bool, str]]" = asyncio.Queue(maxsize=INGEST_QUEUE_MAX)
+        self.ingest_task: Optional[asyncio.Task] = None
+        self.backfill_task: Optional[asyncio.Task] = None
+        self.backfill_stats = {
+            "state": "idle", "lo": None, "hi": None, "cursor": None,
+            "messages": 0, "pages": 0, "run_messages": 0, "started": None, "elapsed": 0.0, "error": None,
+        }
+
+_channels: Dict[int, ChannelState] = {}  # channel id -> state
+
+def is_local_guild(guild_id: int) -> bool:
+    # guild -> shard is (guild_id >> 22) % shard_count
+    return SHARD_IDS is None or (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+def state_for(interaction: discord.Interaction) -> Optional[ChannelState]:
+    # the tracked channel the command was used in, else the guild's first one
+    st = _channels.get(interaction.channel_id)
+    if st is None:
+        st = next((c for c in _channels.values() if c.guild_id == interaction.guild_id), None)
+    return st
+
 # ---------------- DB HELPERS ----------------
+SCHEMA_VERSION = 3  # PRAGMA user_version; 1 = integer type ids, 2 = per-channel rows, 3 = counted flag
+
+# tables rebuilt (new primary keys) when upgrading from below a version;
+# egg_types first, the others look the ids of their egg_type names up in it
+_REBUILT_BELOW = {
+    1: ["egg_types", "egg_counts_today", "egg_counts_daily", "egg_message_hits", "egg_counts_hourly"],
+    2: ["egg_counts_today", "egg_counts_daily", "egg_counts_hourly"],
+}
+# columns added in place (constant default: no row is rewritten): (version, table, column, type)
+_ADDED_COLUMNS = [
+    (2, "egg_messages", "channel_id", f"INTEGER NOT NULL DEFAULT {CHANNEL_ID}"),
+    (2, "egg_index_ranges", "channel_id", f"INTEGER NOT NULL DEFAULT {CHANNEL_ID}"),
+    (3, "egg_messages", "counted", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+def _table_columns(cur: sqlite3.Cursor, table: str) -> List[str]:
+    return [r[1] for r in cur.execute(f"PRAGMA table_info({table})")]
+
+def _copy_rebuilt(cur: sqlite3.Cursor, table: str):
+    # each new column from the old table: same column, id of the old egg_type
+    # name, or CHANNEL_ID; anything else (egg_types.id) is assigned on insert
+    old = _table_columns(cur, f"{table}_old")
+    cols, select = [], []
+    for col in _table_columns(cur, table):
+        if col in old:
+            select.append(f"o.{col}")
+        elif col == "type_id" and "egg_type" in old:
+            select.append("t.id")
+        elif col == "channel_id":
+            select.append(str(CHANNEL_ID))
+        else:
+            continue
+        cols.append(col)
+    join = " JOIN egg_types t ON t.name = o.egg_type" if "egg_type" in old else ""
+    order = " ORDER BY o.rowid" if table == "egg_types" else ""
+    cur.execute(f"INSERT INTO {table}({', '.join(cols)}) SELECT {', '.join(select)} FROM {table}_old o{join}{order}")
+
 def _create_tables(conn: sqlite3.Connection):
     cur = conn.cursor()
+    # Older layouts are upgraded in place, in one transaction: rebuilt tables are
+    # renamed, recreated below, copied and dropped. Existing rows belong to
+    # CHANNEL_ID; counts of types missing from egg_types (removed) are dropped.
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    old, added = [], []
+    if version < 2:
+        old = [t for t in _REBUILT_BELOW[1 if version < 1 else 2] if _table_columns(cur, t)]
+    if version < SCHEMA_VERSION:
+        added = [(t, col, decl) for v, t, col, decl in _ADDED_COLUMNS
+                 if version < v and _table_columns(cur, t) and col not in _table_columns(cur, t)]
+    if old or added:
+        print(f"Migrating database to schema version {SCHEMA_VERSION}...")
+        cur.execute("BEGIN")
+        for table in old:
+            cur.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+        for table, col, decl in added:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS egg_types (
-        name TEXT PRIMARY KEY,
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
         pattern TEXT NOT NULL,
         emoji TEXT
     )""")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS egg_counts_today (
-        egg_type TEXT PRIMARY KEY,
-        count INTEGER NOT NULL
-    )""")
+        channel_id INTEGER NOT NULL,
+        type_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY(channel_id, type_id)
+    ) WITHOUT ROWID""")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS egg_counts_daily (
+        channel_id INTEGER NOT NULL,
         date TEXT NOT NULL,
-        egg_type TEXT NOT NULL,
+        type_id INTEGER NOT NULL,
         count INTEGER NOT NULL,
-        PRIMARY KEY(date, egg_type)
+        PRIMARY KEY(channel_id, date, type_id)
+    ) WITHOUT ROWID""")
+    # per-message match index (see MESSAGE INDEX below); counted = added to the live counters
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_messages (
+        message_id INTEGER PRIMARY KEY,
+        created_at REAL NOT NULL,
+        webhook INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        channel_id INTEGER NOT NULL DEFAULT 0,
+        counted INTEGER NOT NULL DEFAULT 0
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_egg_messages_created ON egg_messages(created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_egg_messages_channel ON egg_messages(channel_id, created_at)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_message_hits (
+        message_id INTEGER NOT NULL,
+        type_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY(message_id, type_id)
+    ) WITHOUT ROWID""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_index_ranges (
+        id INTEGER PRIMARY KEY,
+        start REAL NOT NULL,
+        end REAL NOT NULL,
+        channel_id INTEGER NOT NULL DEFAULT 0
+    )""")
+    # hourly rollup of the index; webhook_count is the ONLY_WEBHOOK view
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_counts_hourly (
+        channel_id INTEGER NOT NULL,
+        bucket_start INTEGER NOT NULL,
+        type_id INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        webhook_count INTEGER NOT NULL,
+        PRIMARY KEY(channel_id, bucket_start, type_id)
+    ) WITHOUT ROWID""")
+    # small key/value store (command tree hash, ...)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )""")
+    # resumable history backfill job (see BACKFILL below)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS egg_backfill (
+        channel_id INTEGER PRIMARY KEY,
+        lo REAL NOT NULL,
+        hi REAL NOT NULL,
+        cursor_id INTEGER NOT NULL,
+        messages INTEGER NOT NULL DEFAULT 0,
+        done INTEGER NOT NULL DEFAULT 0
     )""")
+    if old or added:
+        for table in old:
+            _copy_rebuilt(cur, table)
+            if table == "egg_types":
+                # built-in types that were counted but never written to egg_types
+                cur.executemany("INSERT OR IGNORE INTO egg_types(name, pattern, emoji) VALUES(?, ?, ?)",
+                                [(n, rx.pattern, EGG_EMOJIS.get(n)) for n, rx in PATTERN_MAP.items()])
+            cur.execute(f"DROP TABLE {table}_old")
+        cur.execute("COMMIT")
+    cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
     conn.commit()
 
+def _resolve(fut: asyncio.Future, result=None, exc: Optional[BaseException] = None):
+    if fut.cancelled():
+        return
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(result)
+
+def _db_writer_loop(conn: sqlite3.Connection):
+    # Drains the write queue: every job already waiting is committed in ONE
+    # transaction, each inside its own savepoint so a failing statement only
+    # fails its caller. "raw" jobs (VACUUM, checkpoints) run outside any transaction.
+    carry = None  # raw job found while draining: runs next, on its own
+    while True:
+        job, carry = (carry, None) if carry is not None else (_db_write_queue.get(), None)
+        if job is None:
+            return
+        batch = [job]
+        stop = False
+        while len(batch) < DB_WRITE_BATCH and not batch[-1][1]:
+            try:
+                nxt = _db_write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if nxt is None:
+                stop = True
+                break
+            if nxt[1]:
+                carry = nxt  # keeps its place: nothing queued after it runs first
+                break
+            batch.append(nxt)
+
+        if batch[0][1]:
+            fn, _, loop, fut = batch[0]
+            try:
+                res, exc = fn(conn), None
+            except Exception as e:
+                res, exc = None, e
+            loop.call_soon_threadsafe(_resolve, fut, res, exc)
+        else:
+            results = []
+            t0 = time.perf_counter()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for fn, _, loop, fut in batch:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((fn(conn), None))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((None, e))
+                conn.execute("COMMIT")
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                results = [(None, e)] * len(batch)
+            if METRICS_ENABLED:
+                # the write lock is held for the whole transaction
+                metric_time("db_write_tx_held", time.perf_counter() - t0)
+                metric_inc("db_write_jobs", len(batch))
+                metric_inc("db_commits")
+            for (fn, _, loop, fut), (res, exc) in zip(batch, results):
+                loop.call_soon_threadsafe(_resolve, fut, res, exc)
+        if stop:
+            return
+
+async def db_run_write(fn, raw: bool = False):
+    """Run fn(conn) on the writer thread; resolves after its transaction commits."""
+    loop = asyncio.get_running_loop()
+    fut = loop.create_future()
+    _db_write_queue.put((fn, raw, loop, fut))
+    return await fut
+
+def _read_conn() -> sqlite3.Connection:
+    conn = getattr(_db_read_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(Path(DB_PATH).absolute().as_uri() + "?mode=ro", uri=True,
+                               check_same_thread=False, cached_statements=DB_CACHED_STATEMENTS)
+        _db_read_local.conn = conn
+        _db_read_conns.append(conn)
+    return conn
+
 async def db_init():
-    global _db_conn
+    global _db_conn, _db_writer, _db_read_pool
+    if _db_conn is not None:
+        return
     loop = asyncio.get_running_loop()
     def _open():
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        # autocommit mode: the writer thread issues BEGIN/COMMIT itself
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None,
+                               cached_statements=DB_CACHED_STATEMENTS)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")  # takes effect on new files
         conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        # checkpoints are run by retention_task when idle, not inside a hot commit
+        conn.execute("PRAGMA wal_autocheckpoint=0;")
         _create_tables(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # one-time conversion of an existing eggs.db
+            conn.execute("VACUUM")
         return conn
     _db_conn = await loop.run_in_executor(None, _open)
+    _db_writer = threading.Thread(target=_db_writer_loop, args=(_db_conn,), name="egg-db-writer", daemon=True)
+    _db_writer.start()
+    _db_read_pool = ThreadPoolExecutor(max_workers=max(1, DB_READERS), thread_name_prefix="egg-db-read")
 
 async def db_close():
-    global _db_conn
+    global _db_conn, _db_writer, _db_read_pool
     if _db_conn:
-        await asyncio.get_running_loop().run_in_executor(None, _db_conn.close)
-        _db_conn = None
+        loop = asyncio.get_running_loop()
+        _db_write_queue.put(None)
+        await loop.run_in_executor(None, _db_writer.join)
+        _db_read_pool.shutdown(wait=True)
+        for conn in _db_read_conns:
+            conn.close()
+        _db_read_conns.clear()
+        await loop.run_in_executor(None, _db_conn.close)
+        _db_conn, _db_writer, _db_read_pool = None, None, None
 
+@timed("db_execute")
 async def db_execute(query: str, params: Tuple = ()):
-    async with _db_lock:
-        loop = asyncio.get_running_loop()
-        def _exec():
-            cur = _db_conn.cursor()
-            cur.execute(query, params)
-            _db_conn.commit()
-            return cur
-        return await loop.run_in_executor(None, _exec)
+    return await db_run_write(lambda conn: conn.execute(query, params))
+
+@timed("db_write_batch")
+async def db_write_batch(ops: List[Tuple[str, list]]):
+    # several executemany() calls in ONE transaction / commit
+    def _exec(conn):
+        for query, seq_params in ops:
+            conn.executemany(query, seq_params)
+    return await db_run_write(_exec)
 
+@timed("db_fetchall")
 async def db_fetchall(query: str, params: Tuple = ()):
-    async with _db_lock:
-        loop = asyncio.get_running_loop()
+    if not METRICS_ENABLED:
         def _fetch():
-            cur = _db_conn.cursor()
-            cur.execute(query, params)
-            return cur.fetchall()
-        return await loop.run_in_executor(None, _fetch)
+            return _read_conn().execute(query, params).fetchall()
+        return await asyncio.get_running_loop().run_in_executor(_db_read_pool, _fetch)
+
+    global _db_reads_in_flight
+    submitted = time.perf_counter()
+    def _fetch_timed():
+        metric_time("db_read_queue_wait", time.perf_counter() - submitted)
+        return _read_conn().execute(query, params).fetchall()
+    _db_reads_in_flight += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_db_read_pool, _fetch_timed)
+    finally:
+        _db_reads_in_flight -= 1
+
+# write-behind: live hits only mark a type dirty on their channel (caller holds
+# its lock) and queue their index rows; persist_flush_task writes every
+# channel's pending entries in one transaction
+_flush_wakeup = asyncio.Event()
+_flush_lock = asyncio.Lock()
+_flush_task: Optional[asyncio.Task] = None
+_types_pending: List[str] = []  # auto-detected types not in egg_types yet
 
-# persistence helpers
-async def persist_today_count(egg_type: str, count: int):
-    await db_execute("INSERT OR REPLACE INTO egg_counts_today(egg_type, count) VALUES(?, ?)", (egg_type, count))
+def mark_today_dirty(st: ChannelState, egg_type: str, count: int):
+    st.dirty[type_id(egg_type)] = count
+    if len(st.dirty) >= PERSIST_MAX_DIRTY:
+        _flush_wakeup.set()
+
+async def flush_pending_writes(states: Optional[List[ChannelState]] = None):
+    """Write pending counts, index rows and live range ends of the given channels (default: all)."""
+    async with _flush_lock:
+        if _db_conn is None:
+            return
+        now = datetime.now(timezone.utc).timestamp()
+        taken, counts, ranges, ops = [], [], [], []
+        for st in (_channels.values() if states is None else states):
+            if not (st.dirty or st.index_pending or st.range_id is not None):
+                continue
+            batch = list(st.dirty.items())
+            st.dirty.clear()
+            rows, st.index_pending = st.index_pending, []
+            taken.append((st, batch, rows))
+            counts += [(st.channel_id, tid, cnt) for tid, cnt in batch]
+            if rows:
+                ops += _index_row_ops(st.channel_id, rows)
+            if st.range_id is not None:
+                ranges.append((now, st.range_id))
+        types = [n for n in _types_pending if n in PATTERN_MAP]
+        _types_pending.clear()
+        if not (taken or types):
+            return
+        ops = [(_UPSERT_TYPE, [(type_id(n), n, PATTERN_MAP[n].pattern, EGG_EMOJIS.get(n)) for n in types]),
+               ("INSERT OR REPLACE INTO egg_counts_today(channel_id, type_id, count) VALUES(?, ?, ?)", counts)] + ops
+        ops.append(("UPDATE egg_index_ranges SET end = ? WHERE id = ?", ranges))
+        try:
+            await db_write_batch(ops)
+        except Exception as e:
+            print("Flushing pending writes failed:", e)
+            # keep anything newer that was marked while we were writing
+            for st, batch, rows in taken:
+                for tid, cnt in batch:
+                    st.dirty.setdefault(tid, cnt)
+                st.index_pending[:0] = rows
+            _types_pending[:0] = types
+
+async def persist_flush_task():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), timeout=PERSIST_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        await flush_pending_writes()
+
+def queue_index_row(st: ChannelState, row: Tuple[int, float, int, str, Dict[str, int]]):
+    st.index_pending.append(row)
+    if len(st.index_pending) >= PERSIST_MAX_DIRTY:
+        _flush_wakeup.set()
+
+_UPSERT_TYPE = "INSERT OR REPLACE INTO egg_types(id, name, pattern, emoji) VALUES(?, ?, ?, ?)"
 
 async def persist_type(name: str, pattern: str, emoji: Optional[str] = None):
-    await db_execute("INSERT OR REPLACE INTO egg_types(name, pattern, emoji) VALUES(?, ?, ?)", (name, pattern, emoji))
+    await db_execute(_UPSERT_TYPE, (type_id(name), name, pattern, emoji))
+
+def adopt_type_ids(rows: List[Tuple[int, str]]):
+    """Use the ids stored in egg_types; types only known in memory get new ones."""
+    global _type_names
+    if all(_type_ids.get(name) == tid for tid, name in rows):
+        return
+    saved = [(st, {name: st.counts.get(name) for name in _type_ids},
+              {_type_names[tid]: cnt for tid, cnt in st.dirty.items()}) for st in _channels.values()]
+    local = [name for name in _type_ids if name not in {n for _, n in rows}]
+    _type_ids.clear()
+    _type_names = [None] * (max((tid for tid, _ in rows), default=0) + 1)
+    for tid, name in rows:
+        _type_ids[name] = tid
+        _type_names[tid] = name
+    for name in local:
+        type_id(name)
+    for st, counts, dirty in saved:
+        st.counts.vals = array("q")
+        for name, cnt in counts.items():
+            if cnt:
+                st.counts[name] = cnt
+        st.dirty.clear()
+        for name, cnt in dirty.items():
+            st.dirty[type_id(name)] = cnt
+        # the minute ring is keyed by id too; restore_window rebuilds it
+        st.win_counts = {}
+        st.win_valid_since = float("inf")
 
 async def load_persisted_types():
-    rows = await db_fetchall("SELECT name, pattern, emoji FROM egg_types")
-    for name, pattern, emoji in rows:
+    rows = await db_fetchall("SELECT id, name, pattern, emoji FROM egg_types")
+    adopt_type_ids([(tid, name) for tid, name, _, _ in rows])
+    for _, name, pattern, emoji in rows:
         try:
-            PATTERN_MAP[name] = re.compile(pattern)
+            register_pattern(name, re.compile(pattern))
             if emoji:
                 EGG_EMOJIS[name] = emoji
-            egg_counts.setdefault(name, 0)
         except re.error:
             print("Invalid regex in DB for", name)
+    # built-in types get their id written once
+    stored = {name for _, name, _, _ in rows}
+    missing = [(type_id(n), n, rx.pattern, EGG_EMOJIS.get(n)) for n, rx in PATTERN_MAP.items() if n not in stored]
+    if missing:
+        await db_write_batch([(_UPSERT_TYPE, missing)])
+
+async def load_today_counts(st: ChannelState):
+    rows = await db_fetchall("SELECT type_id, count FROM egg_counts_today WHERE channel_id = ?", (st.channel_id,))
+    async with st.lock:
+        for tid, cnt in rows:
+            name = type_name(tid)
+            if name is not None:
+                st.counts[name] = cnt
 
-async def load_today_counts():
-    rows = await db_fetchall("SELECT egg_type, count FROM egg_counts_today")
-    async with counts_lock:
-        for et, cnt in rows:
-            egg_counts[et] = cnt
+def _daily_total_ops(date_str: str, totals: Dict[int, TypeCounters]) -> List[Tuple[str, list]]:
+    # channel id -> that channel's counters
+    return [("INSERT OR REPLACE INTO egg_counts_daily(channel_id, date, type_id, count) VALUES(?, ?, ?, ?)",
+             [(cid, date_str, type_id(name), cnt) for cid, counts in totals.items() for name, cnt in counts.items()])]
 
-async def persist_daily_totals(date_str: str, totals: Dict[str,int]):
-    for name, cnt in totals.items():
-        await db_execute("INSERT OR REPLACE INTO egg_counts_daily(date, egg_type, count) VALUES(?, ?, ?)", (date_str, name, cnt))
 
 async def cleanup_old_daily_rows(keep_days: int):
-    cutoff = (datetime.utcnow().date() - timedelta(days=keep_days)).isoformat()
-    await db_execute("DELETE FROM egg_counts_daily WHERE date < ?", (cutoff,))
-    # vacuum
-    async with _db_lock:
-        await asyncio.get_running_loop().run_in_executor(None, _db_conn.execute, "VACUUM")
-        await asyncio.get_running_loop().run_in_executor(None, _db_conn.commit)
+    # chunked deletes only; freed pages are returned by retention_task when idle
+    await run_retention(keep_days)
 
 # ---------------- TEXT EXTRACTION ----------------
 def extract_text(msg: discord.Message) -> str:
@@ -189,24 +939,693 @@ def extract_text(msg: discord.Message) -> str:
     return " ".join(parts)
 
 # ---------------- HISTORY SCANS ----------------
-async def fast_count_single(channel: discord.TextChannel, since, before, rx: re.Pattern):
-    total = 0
-    async for msg in channel.history(limit=None, after=since, before=before):
-        if ONLY_WEBHOOK and not msg.webhook_id:
+# Large scans are split into snowflake-id slices fetched concurrently. discord.py
+# consumes the rate-limit headers itself (it sleeps when a bucket is exhausted),
+# so throttling shows up as a slow page: the worker limit grows by one per clean
+# page and halves on a throttled one (AIMD), bounded by SCAN_MAX_WORKERS.
+class _ScanLimiter:
+    def __init__(self, max_workers: int):
+        self.max_workers = max(1, max_workers)
+        self.limit = min(2, self.max_workers)
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    async def page(self, seconds: float):
+        async with self._cond:
+            if seconds >= SCAN_THROTTLE_SECONDS:
+                self.limit = max(1, self.limit // 2)
+            elif self.limit < self.max_workers:
+                self.limit += 1
+                self._cond.notify_all()
+
+def _scan_slices(lo_id: int, hi_id: int, span_seconds: float) -> List[Tuple[int, int]]:
+    # exclusive (lo_id, hi_id) -> adjacent (after, before) pairs for history();
+    # interior slices start at boundary-1 so the boundary id is fetched exactly once
+    n = min(SCAN_MAX_WORKERS * 4, int(span_seconds // SCAN_MIN_SLICE_SECONDS))
+    if n <= 1:
+        return [(lo_id, hi_id)]
+    step = (hi_id - lo_id) // n
+    bounds = [lo_id + i * step for i in range(n)] + [hi_id]
+    return [(bounds[0], bounds[1])] + [(bounds[i] - 1, bounds[i + 1]) for i in range(1, n)]
+
+# ---- process-pool matching (SCAN_PROCESS_WORKERS > 0) ----
+# Workers are spawned (not forked: the parent runs DB threads) with the pattern
+# set compiled once in the initializer; the pool is replaced when PATTERN_MAP
+# changes, so custom regexes never run on the event loop during big scans.
+_match_pool: Optional[ProcessPoolExecutor] = None
+_match_pool_version = -1
+
+def _match_worker_init(patterns: List[Tuple[str, str]]):
+    PATTERN_MAP.clear()
+    for name, pattern in patterns:
+        PATTERN_MAP[name] = re.compile(pattern)
+    rebuild_matcher()
+
+def _match_worker_batch(texts: List[str]) -> List[Dict[str, int]]:
+    return [count_hits(t) for t in texts]
+
+def _get_match_pool() -> ProcessPoolExecutor:
+    global _match_pool, _match_pool_version
+    if _match_pool is None or _match_pool_version != _pattern_version:
+        if _match_pool is not None:
+            _match_pool.shutdown(wait=False, cancel_futures=False)
+        _match_pool = ProcessPoolExecutor(
+            max_workers=SCAN_PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_match_worker_init,
+            initargs=([(n, rx.pattern) for n, rx in PATTERN_MAP.items()],))
+        _match_pool_version = _pattern_version
+    return _match_pool
+
+def shutdown_match_pool():
+    global _match_pool
+    if _match_pool is not None:
+        _match_pool.shutdown(wait=False, cancel_futures=True)
+        _match_pool = None
+
+async def _match_rows(pending: List[Tuple[int, float, int, str]]) -> list:
+    # (id, created_at, webhook, text) -> index rows with hits
+    if SCAN_PROCESS_WORKERS > 0:
+        hits_list = await asyncio.get_running_loop().run_in_executor(
+            _get_match_pool(), _match_worker_batch, [p[3] for p in pending])
+    else:
+        hits_list = [count_hits(p[3]) for p in pending]
+    return [p + (hits,) for p, hits in zip(pending, hits_list)]
+
+async def _scan_slice(channel, after_id: int, before_id: int, totals: Dict[str, int],
+                      index_rows: Optional[list], limiter: _ScanLimiter):
+    # index_rows collects every scanned message (webhook or not) for the index
+    pending: List[Tuple[int, float, int, str]] = []
+
+    async def _drain():
+        for row in await _match_rows(pending):
+            if index_rows is not None:
+                index_rows.append(row)
+            if not (ONLY_WEBHOOK and not row[2]):
+                for name, n in row[4].items():
+                    totals[name] = totals.get(name, 0) + n
+        pending.clear()
+
+    await limiter.acquire()
+    try:
+        loop = asyncio.get_running_loop()
+        last = loop.time()
+        seen = 0
+        async for msg in channel.history(limit=None, after=discord.Object(id=after_id),
+                                         before=discord.Object(id=before_id)):
+            if seen % 100 == 0:  # first message of a page: the gap was the fetch
+                now = loop.time()
+                await limiter.page(now - last)
+                if METRICS_ENABLED:
+                    metric_time("history_page", now - last)
+            seen += 1
+            if index_rows is None and ONLY_WEBHOOK and not msg.webhook_id:
+                last = loop.time()
+                continue
+            pending.append((msg.id, msg.created_at.timestamp(), 1 if msg.webhook_id else 0, extract_text(msg)))
+            if SCAN_PROCESS_WORKERS <= 0 or len(pending) >= SCAN_PROCESS_BATCH:
+                await _drain()
+            last = loop.time()
+        if pending:
+            await _drain()
+    finally:
+        await limiter.release()
+
+@timed("fast_count_all")
+async def fast_count_all(channel: discord.TextChannel, since, before, index_rows: Optional[list] = None):
+    totals = {name: 0 for name in PATTERN_MAP.keys()}
+    before = before or datetime.now(timezone.utc)
+    # same bounds history() derives from datetimes; nothing predates the channel
+    lo_id = discord.utils.time_snowflake(since, high=True) if since else max(int(channel.id) - 1, 0)
+    hi_id = discord.utils.time_snowflake(before, high=False)
+    if hi_id <= lo_id + 1:
+        return totals
+    span = (discord.utils.snowflake_time(hi_id) - discord.utils.snowflake_time(lo_id)).total_seconds()
+    limiter = _ScanLimiter(SCAN_MAX_WORKERS)
+    await asyncio.gather(*(
+        _scan_slice(channel, a, b, totals, index_rows, limiter) for a, b in _scan_slices(lo_id, hi_id, span)
+    ))
+    return totals
+
+# ---------------- MESSAGE INDEX ----------------
+# Every message the bot sees live (and every message a history scan had to
+# fetch) is stored with its per-type hits. egg_index_ranges records which time
+# ranges are complete, so history commands only page Discord for the gaps
+# (before the first live session, or while the bot was offline) and append
+# what they fetched. The extracted text is kept (and expires with the index
+# after KEEP_DAYS) because it is the only way to back-fill a type added later
+# (/egg_addtype, auto-detection) without re-paging KEEP_DAYS of Discord history.
+HOUR = 3600
+
+_ROLLUP_SELECT = (
+    "SELECT m.channel_id, CAST(m.created_at / 3600 AS INTEGER) * 3600, h.type_id, SUM(h.count), "
+    "SUM(CASE WHEN m.webhook THEN h.count ELSE 0 END) "
+    "FROM egg_message_hits h JOIN egg_messages m USING(message_id) "
+)
+
+def _rollup_ops(channel_id: int, buckets) -> List[Tuple[str, list]]:
+    # recompute the channel's hourly rollup for these buckets from the index
+    buckets = sorted(buckets)
+    return [
+        ("DELETE FROM egg_counts_hourly WHERE channel_id = ? AND bucket_start = ?", [(channel_id, b) for b in buckets]),
+        ("INSERT INTO egg_counts_hourly(channel_id, bucket_start, type_id, count, webhook_count) " + _ROLLUP_SELECT +
+         "WHERE m.channel_id = ? AND m.created_at >= ? AND m.created_at < ? GROUP BY 1, 2, 3",
+         [(channel_id, b, b + HOUR) for b in buckets]),
+    ]
+
+def _stored_text(webhook, text: str) -> str:
+    # only text that could ever count (a possible hatch message) is kept
+    return text if INDEX_TEXT and (webhook or not ONLY_WEBHOOK) else ""
+
+def _index_row_ops(channel_id: int, rows) -> List[Tuple[str, list]]:
+    # rows: (id, created_at, webhook, text, hits[, counted]). Rollup buckets touched by
+    # the batch are recomputed from the index in the same transaction, so
+    # re-fetched (ignored) duplicates are never double counted
+    return [
+        ("INSERT OR IGNORE INTO egg_messages(message_id, created_at, webhook, text, channel_id, counted) "
+         "VALUES(?, ?, ?, ?, ?, ?)",
+         [r[:3] + (_stored_text(r[2], r[3]), channel_id, r[5] if len(r) > 5 else 0) for r in rows]),
+        ("INSERT OR IGNORE INTO egg_message_hits(message_id, type_id, count) VALUES(?, ?, ?)",
+         [(r[0], type_id(name), n) for r in rows for name, n in r[4].items()]),
+    ] + _rollup_ops(channel_id, {int(r[1] // HOUR) * HOUR for r in rows})
+
+def _index_gaps(ranges, lo: float, hi: float) -> List[Tuple[float, float]]:
+    gaps = []
+    cur = lo
+    for start, end in sorted(ranges):
+        if end <= cur:
             continue
-        total += len(rx.findall(extract_text(msg)))
-    return total
+        if start >= hi:
+            break
+        if start > cur:
+            gaps.append((cur, start))
+        cur = max(cur, end)
+        if cur >= hi:
+            break
+    if cur < hi:
+        gaps.append((cur, hi))
+    return gaps
+
+async def open_index_range(st: ChannelState) -> bool:
+    # start a new coverage range for live tracking (startup / reconnect); False if one is open
+    if st.range_id is not None:
+        return False
+    now = datetime.now(timezone.utc).timestamp()
+    cur = await db_execute("INSERT INTO egg_index_ranges(start, end, channel_id) VALUES(?, ?, ?)",
+                           (now, now, st.channel_id))
+    st.range_id = cur.lastrowid
+    return True
+
+async def close_index_range(st: ChannelState):
+    await flush_pending_writes([st])
+    st.range_id = None
+    st.win_valid_since = float("inf")  # live messages may be missed until restore
+
+async def backfill_index(channel: discord.TextChannel, lo: float, hi: float):
+    rows: list = []
+    # widen by 1ms: history() bounds are exclusive, duplicates are ignored on insert
+    await fast_count_all(channel, datetime.fromtimestamp(lo - 0.001, timezone.utc),
+                         datetime.fromtimestamp(hi + 0.001, timezone.utc), index_rows=rows)
+    await db_write_batch(_index_row_ops(channel.id, rows) +
+                         [("INSERT INTO egg_index_ranges(start, end, channel_id) VALUES(?, ?, ?)", [(lo, hi, channel.id)])])
+
+async def range_totals(channel: discord.TextChannel, since: Optional[datetime], before: Optional[datetime]) -> Dict[str, int]:
+    """Totals for (since, before): whole hours from egg_counts_hourly, only the
+    partial edge hours from the message index. Uncovered gaps are fetched first."""
+    st = _channels.get(channel.id)
+    await flush_pending_writes([st] if st else [])
+    lo = since.timestamp() if since else 0.0
+    hi = (before or datetime.now(timezone.utc)).timestamp()
+    ranges = await db_fetchall("SELECT start, end FROM egg_index_ranges WHERE channel_id = ?", (channel.id,))
+    gaps = _index_gaps(ranges, lo, hi)
+    for g_lo, g_hi in gaps:
+        await backfill_index(channel, g_lo, g_hi)
+    if st and gaps and hi > st.win_valid_since - WINDOW_HOURS * HOUR:
+        # the filled gap may extend what the in-memory window can answer
+        client.loop.create_task(restore_window(st))
 
-async def fast_count_all(channel: discord.TextChannel, since, before):
+    # first whole bucket starts strictly after lo (lo itself is exclusive)
+    full_lo = int(lo // HOUR) * HOUR + HOUR
+    full_hi = int(hi // HOUR) * HOUR
+    # edges: (lo, full_lo) and [full_hi, hi); full_hi is the trailing partial hour's own start
+    edges = [(">", lo, full_lo), (">=", full_hi, hi)] if full_lo < full_hi else [(">", lo, hi)]
+    webhook = " AND m.webhook = 1" if ONLY_WEBHOOK else ""
+    rows = []
+    for op, e_lo, e_hi in edges:
+        rows += await db_fetchall(
+            "SELECT h.type_id, SUM(h.count) FROM egg_message_hits h JOIN egg_messages m USING(message_id) "
+            f"WHERE m.channel_id = ? AND m.created_at {op} ? AND m.created_at < ?" + webhook + " GROUP BY h.type_id",
+            (channel.id, e_lo, e_hi))
+    if full_lo < full_hi:
+        col = "webhook_count" if ONLY_WEBHOOK else "count"
+        rows += await db_fetchall(
+            f"SELECT type_id, SUM({col}) FROM egg_counts_hourly "
+            "WHERE channel_id = ? AND bucket_start >= ? AND bucket_start < ? GROUP BY type_id",
+            (channel.id, full_lo, full_hi))
     totals = {name: 0 for name in PATTERN_MAP.keys()}
-    async for msg in channel.history(limit=None, after=since, before=before):
-        if ONLY_WEBHOOK and not msg.webhook_id:
+    for tid, cnt in rows:
+        name = type_name(tid)
+        if name in totals:
+            totals[name] += cnt or 0
+    return totals
+
+REINDEX_CHUNK = 2000
+
+def _reindex_batch(patterns: List[Tuple[int, str]], rows: List[Tuple[int, str]]) -> List[Tuple[int, int, int]]:
+    # runs in a worker thread (or a match pool process): hits of the given types only
+    compiled = [(tid, re.compile(pattern)) for tid, pattern in patterns]
+    return [(mid, tid, n) for mid, text in rows for tid, rx in compiled for n in (len(rx.findall(text)),) if n]
+
+async def reindex_types(names: List[str]):
+    # back-fill hits of newly added types from the stored message text (none with
+    # INDEX_TEXT=0: such types only count from now on). The index
+    # is read in REINDEX_CHUNK rows (message id order = time order) and matched
+    # off the event loop, one chunk at a time, so live ingest keeps running
+    types = [(type_id(n), n, PATTERN_MAP[n]) for n in names if n in PATTERN_MAP]
+    if not types or _db_conn is None:
+        return
+    await flush_pending_writes()
+    tids = [(tid,) for tid, _, _ in types]
+    patterns = [(tid, rx.pattern) for tid, _, rx in types]
+    # live batches from here on store their own hits for these types
+    await db_write_batch([("DELETE FROM egg_message_hits WHERE type_id = ?", tids)])
+    loop = asyncio.get_running_loop()
+    last_id = -1
+    while True:
+        rows = await db_fetchall("SELECT message_id, text FROM egg_messages WHERE message_id > ? AND text != '' "
+                                 "ORDER BY message_id LIMIT ?", (last_id, REINDEX_CHUNK))
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        executor = _get_match_pool() if SCAN_PROCESS_WORKERS > 0 else None
+        hits = await loop.run_in_executor(executor, _reindex_batch, patterns, rows)
+        if hits:
+            # skip messages deleted (edit/delete correction, retention) since the read
+            await db_write_batch([("INSERT OR REPLACE INTO egg_message_hits(message_id, type_id, count) "
+                                   "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM egg_messages WHERE message_id = ?)",
+                                   [(mid, tid, n, mid) for mid, tid, n in hits])])
+    await db_write_batch([
+        ("DELETE FROM egg_counts_hourly WHERE type_id = ?", tids),
+        ("INSERT INTO egg_counts_hourly(channel_id, bucket_start, type_id, count, webhook_count) " + _ROLLUP_SELECT +
+         "WHERE h.type_id = ? GROUP BY 1, 2, 3", tids),
+    ])
+    invalidate_query_cache()
+    # today's live counters get the messages they missed (seen before the type existed)
+    today = local_midnight(datetime.now(timezone.utc)).timestamp()
+    for st in list(_channels.values()):
+        async with st.lock:
+            await flush_pending_writes([st])
+            for tid, cnt in await db_fetchall(
+                    "SELECT h.type_id, SUM(h.count) FROM egg_message_hits h JOIN egg_messages m USING(message_id) "
+                    "WHERE m.channel_id = ? AND m.counted = 1 AND m.created_at >= ? "
+                    f"AND h.type_id IN ({','.join('?' * len(tids))}) GROUP BY 1",
+                    (st.channel_id, today) + tuple(t for (t,) in tids)):
+                name = type_name(tid)
+                if name is not None and cnt > st.counts.get(name):
+                    st.counts[name] = cnt
+                    mark_today_dirty(st, name, cnt)
+        await restore_window(st)
+
+# ---------------- BACKFILL ----------------
+# Admin-triggered walk of the channel history, oldest first, over every part of
+# the last N days the index doesn't cover yet. Each page of up to 100 messages is
+# written in one transaction together with the coverage range end and the job
+# cursor (last message id), so a crash or reconnect resumes at the next page.
+# Once all gaps are filled, complete days without a persisted daily total get
+# one from the index (live totals are never overwritten). Writes go through the
+# writer queue page by page, so live batches interleave with the job.
+# One job per channel (ChannelState.backfill_task / backfill_stats).
+BACKFILL_PAGE = 100
+
+def _backfill_daily_ops(channel_id: int, lo: float, hi: float) -> List[Tuple[str, list]]:
+    # complete local days in [lo, hi), keyed like daily_report_task keys them
+    day = local_midnight(datetime.fromtimestamp(lo, timezone.utc))
+    if day.timestamp() < lo:
+        day += timedelta(days=1)
+    today = local_midnight(datetime.now(timezone.utc))
+    params = []
+    while day + timedelta(days=1) <= min(today, datetime.fromtimestamp(hi, timezone.utc)):
+        params.append((day.date().isoformat(), channel_id, day.timestamp(), (day + timedelta(days=1)).timestamp()))
+        day += timedelta(days=1)
+    webhook = " AND m.webhook = 1" if ONLY_WEBHOOK else ""
+    return [("INSERT OR IGNORE INTO egg_counts_daily(channel_id, date, type_id, count) "
+             "SELECT m.channel_id, ?, h.type_id, SUM(h.count) FROM egg_message_hits h JOIN egg_messages m USING(message_id) "
+             "WHERE m.channel_id = ? AND m.created_at >= ? AND m.created_at < ?" + webhook + " GROUP BY h.type_id", params)]
+
+async def _backfill_gap(channel, g_lo: float, g_hi: float, cursor_id: int, stats: dict):
+    # widen by 1ms like backfill_index; the cursor skips what a previous run stored
+    after_id = max(cursor_id, discord.utils.time_snowflake(datetime.fromtimestamp(g_lo - 0.001, timezone.utc), high=True))
+    before_id = discord.utils.time_snowflake(datetime.fromtimestamp(g_hi + 0.001, timezone.utc), high=False)
+    cur = await db_execute("INSERT INTO egg_index_ranges(start, end, channel_id) VALUES(?, ?, ?)",
+                           (g_lo, g_lo, channel.id))
+    range_id = cur.lastrowid
+    while after_id < before_id:
+        page = [m async for m in channel.history(limit=BACKFILL_PAGE, after=discord.Object(id=after_id),
+                                                 before=discord.Object(id=before_id), oldest_first=True)]
+        if not page:
+            break
+        rows = await _match_rows([(m.id, m.created_at.timestamp(), 1 if m.webhook_id else 0, extract_text(m))
+                                  for m in page])
+        after_id = page[-1].id
+        # messages sharing the last millisecond may be on the next page
+        end = g_hi if len(page) < BACKFILL_PAGE else min(g_hi, rows[-1][1] - 0.001)
+        await db_write_batch(_index_row_ops(channel.id, rows) + [
+            ("UPDATE egg_index_ranges SET end = ? WHERE id = ? AND end < ?", [(end, range_id, end)]),
+            ("UPDATE egg_backfill SET cursor_id = ?, messages = messages + ? WHERE channel_id = ?",
+             [(after_id, len(page), channel.id)]),
+        ])
+        stats["messages"] += len(page)
+        stats["run_messages"] += len(page)
+        stats["pages"] += 1
+        stats["cursor"] = rows[-1][1]
+        stats["elapsed"] = time.monotonic() - stats["started"]
+        if len(page) < BACKFILL_PAGE:
+            break
+    await db_execute("UPDATE egg_index_ranges SET end = ? WHERE id = ?", (g_hi, range_id))
+
+async def backfill_job(st: ChannelState, channel: discord.TextChannel):
+    rows = await db_fetchall("SELECT lo, hi, cursor_id, messages FROM egg_backfill WHERE channel_id = ? AND done = 0",
+                             (channel.id,))
+    if not rows:
+        return
+    lo, hi, cursor_id, messages = rows[0]
+    stats = st.backfill_stats
+    stats.update(state="running", lo=lo, hi=hi, cursor=lo, messages=messages, pages=0, run_messages=0,
+                 started=time.monotonic(), elapsed=0.0, error=None)
+    try:
+        await flush_pending_writes([st])
+        ranges = await db_fetchall("SELECT start, end FROM egg_index_ranges WHERE channel_id = ?", (channel.id,))
+        for g_lo, g_hi in _index_gaps(ranges, lo, hi):
+            await _backfill_gap(channel, g_lo, g_hi, cursor_id, stats)
+            stats["cursor"] = g_hi
+        await db_write_batch(_backfill_daily_ops(channel.id, lo, hi) + [
+            ("UPDATE egg_backfill SET done = 1 WHERE channel_id = ?", [(channel.id,)])])
+        stats["state"] = "done"
+        _stats_cache.pop(channel.id, None)
+        print(f"Backfill of {channel.id} finished: {stats['messages']} messages")
+    except asyncio.CancelledError:
+        stats["state"] = "stopped"
+        raise
+    except Exception as e:
+        stats.update(state="failed", error=str(e))
+        print(f"Backfill of {channel.id} failed (resumes on next start):", e)
+    finally:
+        stats["elapsed"] = time.monotonic() - stats["started"]
+    invalidate_query_cache()
+    await restore_window(st)
+
+async def start_backfill(channel: discord.TextChannel, days: Optional[int] = None) -> bool:
+    """Start (or resume) the channel's backfill job. days=None only resumes an unfinished job."""
+    st = _channels.get(channel.id)
+    if st is None or (st.backfill_task is not None and not st.backfill_task.done()):
+        return False
+    pending = await db_fetchall("SELECT 1 FROM egg_backfill WHERE channel_id = ? AND done = 0", (channel.id,))
+    if not pending:
+        if days is None:
+            return False
+        # older rows would be removed by retention straight away
+        days = max(1, min(days, KEEP_DAYS))
+        now = datetime.now(timezone.utc)
+        lo = (local_midnight(now) - timedelta(days=days)).timestamp()
+        await db_execute("INSERT OR REPLACE INTO egg_backfill(channel_id, lo, hi, cursor_id, messages, done) "
+                         "VALUES(?, ?, ?, 0, 0, 0)", (channel.id, lo, now.timestamp()))
+    st.backfill_task = client.loop.create_task(backfill_job(st, channel))
+    return True
+
+# ---------------- RETENTION ----------------
+# Expired rows are deleted RETENTION_CHUNK at a time, each chunk its own short
+# write job, so live writes interleave instead of waiting behind one big
+# DELETE + VACUUM at midnight. The file uses auto_vacuum=INCREMENTAL: freed
+# pages are handed back RETENTION_VACUUM_PAGES at a time, and WAL checkpoints
+# are run, only while the writer queue is idle (or when the WAL gets too big).
+retention_stats = {
+    "last_run": None, "rows_deleted": 0, "bytes_reclaimed": 0,
+    "lock_ms_total": 0.0, "lock_ms_max": 0.0, "checkpoints": 0,
+}
+_retention_task: Optional[asyncio.Task] = None
+
+async def _timed_write(fn, raw: bool = False):
+    def _job(conn):
+        t0 = time.perf_counter()
+        res = fn(conn)
+        return res, (time.perf_counter() - t0) * 1000
+    res, ms = await db_run_write(_job, raw=raw)
+    retention_stats["lock_ms_total"] += ms
+    retention_stats["lock_ms_max"] = max(retention_stats["lock_ms_max"], ms)
+    return res
+
+async def _delete_chunked(fn) -> int:
+    total = 0
+    while True:
+        n = await _timed_write(fn)
+        total += n
+        if n < RETENTION_CHUNK:
+            return total
+        await asyncio.sleep(0)
+
+def _delete_messages_chunk(cutoff: float):
+    def _job(conn):
+        ids = [(r[0],) for r in conn.execute(
+            "SELECT message_id FROM egg_messages WHERE created_at < ? LIMIT ?", (cutoff, RETENTION_CHUNK))]
+        conn.executemany("DELETE FROM egg_message_hits WHERE message_id = ?", ids)
+        conn.executemany("DELETE FROM egg_messages WHERE message_id = ?", ids)
+        return len(ids)
+    return _job
+
+async def run_retention(keep_days: int, keep_daily_days: Optional[int] = None):
+    retention_stats["lock_ms_max"] = 0.0
+    daily_days = KEEP_DAILY_DAYS if keep_daily_days is None else keep_daily_days
+    day_cutoff = (datetime.utcnow().date() - timedelta(days=daily_days)).isoformat() if daily_days else ""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=keep_days)).timestamp()
+    bucket_cutoff = int(cutoff // HOUR) * HOUR
+    # shrink index coverage first so no query trusts a half-pruned range
+    await db_write_batch([
+        ("DELETE FROM egg_index_ranges WHERE end <= ?", [(cutoff,)]),
+        ("UPDATE egg_index_ranges SET start = ? WHERE start < ?", [(cutoff, cutoff)]),
+    ])
+    deleted = await _delete_chunked(lambda conn: conn.execute(
+        "DELETE FROM egg_counts_daily WHERE (channel_id, date, type_id) IN "
+        "(SELECT channel_id, date, type_id FROM egg_counts_daily WHERE date < ? LIMIT ?)",
+        (day_cutoff, RETENTION_CHUNK)).rowcount)
+    deleted += await _delete_chunked(_delete_messages_chunk(cutoff))
+    deleted += await _delete_chunked(lambda conn: conn.execute(
+        "DELETE FROM egg_counts_hourly WHERE (channel_id, bucket_start, type_id) IN "
+        "(SELECT channel_id, bucket_start, type_id FROM egg_counts_hourly WHERE bucket_start < ? LIMIT ?)",
+        (bucket_cutoff, RETENTION_CHUNK)).rowcount)
+    retention_stats["rows_deleted"] += deleted
+    retention_stats["last_run"] = datetime.now(timezone.utc).isoformat()
+    print(f"Retention: deleted {deleted} rows, max lock {retention_stats['lock_ms_max']:.1f}ms")
+
+def _maintenance_step(force_checkpoint: bool):
+    def _job(conn):
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if before:
+            # executescript steps the pragma to completion (execute() frees one page)
+            conn.executescript(f"PRAGMA incremental_vacuum({RETENTION_VACUUM_PAGES});")
+        freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        wal = Path(DB_PATH + "-wal")
+        wal_bytes = wal.stat().st_size if wal.exists() else 0
+        mode = "TRUNCATE" if force_checkpoint or wal_bytes > RETENTION_WAL_MAX_BYTES else "PASSIVE"
+        conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchall()
+        return freed * page_size
+    return _job
+
+async def retention_task():
+    while True:
+        await asyncio.sleep(RETENTION_STEP_SECONDS)
+        if _db_conn is None:
             continue
-        text = extract_text(msg)
-        for name, rx in PATTERN_MAP.items():
-            totals[name] += len(rx.findall(text))
+        wal = Path(DB_PATH + "-wal")
+        too_big = wal.exists() and wal.stat().st_size > RETENTION_WAL_MAX_BYTES
+        if not _db_write_queue.empty() and not too_big:
+            continue  # busy: try again next step
+        try:
+            reclaimed = await _timed_write(_maintenance_step(too_big), raw=True)
+        except Exception as e:
+            print("Retention maintenance failed:", e)
+            continue
+        retention_stats["bytes_reclaimed"] += reclaimed
+        retention_stats["checkpoints"] += 1
+        if reclaimed:
+            print(f"Retention: reclaimed {reclaimed} bytes "
+                  f"(total {retention_stats['bytes_reclaimed']}, max lock {retention_stats['lock_ms_max']:.1f}ms)")
+
+# ---------------- QUERY CACHE ----------------
+# Identical /egg and /egg_trend queries share one in-flight range_totals call
+# and reuse its result for QUERY_CACHE_TTL seconds. Totals cover every type, so
+# the key is the channel + normalized window and egg_type is just a projection
+# of it. Open-ended windows ("last 24h") are topped up with hits the channel saw
+# live since the base was computed (ChannelState.live_hits) instead of being
+# recomputed.
+_query_cache: Dict[tuple, Tuple[float, Dict[str, int], Dict[str, int]]] = {}
+_query_inflight: Dict[tuple, asyncio.Future] = {}
+query_cache_stats = {"hits": 0, "misses": 0, "shared": 0, "invalidations": 0}
+
+def note_live_hits(st: ChannelState, row: Tuple[int, float, int, str, Dict[str, int]]):
+    queue_index_row(st, row)
+    if ONLY_WEBHOOK and not row[2]:
+        return
+    live = st.live_hits
+    for name, n in row[4].items():
+        live[name] = live.get(name, 0) + n
+    window_add(st, row[1], row[4])
+
+def invalidate_query_cache(channel_id: Optional[int] = None):
+    keys = [k for k in _query_cache if channel_id is None or k[0] == channel_id]
+    if keys:
+        query_cache_stats["invalidations"] += 1
+    for k in keys:
+        del _query_cache[k]
+
+def _with_live_delta(live: Dict[str, int], base: Dict[str, int], live_at: Optional[Dict[str, int]]) -> Dict[str, int]:
+    totals = dict(base)
+    if live_at is not None:
+        for name, n in live.items():
+            d = n - live_at.get(name, 0)
+            if d and name in totals:
+                totals[name] += d
     return totals
 
+async def cached_range_totals(channel: discord.TextChannel, key: tuple,
+                              since: Optional[datetime], before: Optional[datetime]) -> Dict[str, int]:
+    loop = asyncio.get_running_loop()
+    st = _channels.get(channel.id)
+    live = st.live_hits if st else {}
+    key = (channel.id,) + key
+    entry = _query_cache.get(key)
+    if entry and entry[0] > loop.time():
+        query_cache_stats["hits"] += 1
+        return _with_live_delta(live, entry[1], entry[2])
+    fut = _query_inflight.get(key)
+    if fut is not None:
+        query_cache_stats["shared"] += 1
+        base, live_at = await asyncio.shield(fut)
+        return _with_live_delta(live, base, live_at)
+
+    query_cache_stats["misses"] += 1
+    fut = loop.create_future()
+    _query_inflight[key] = fut
+    try:
+        # open windows: pin the upper bound to the live snapshot we top up from
+        live_at = dict(live) if before is None else None
+        base = await range_totals(channel, since, before or datetime.now(timezone.utc))
+        _query_cache[key] = (loop.time() + QUERY_CACHE_TTL, base, live_at)
+        fut.set_result((base, live_at))
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _query_inflight.pop(key, None)
+    return _with_live_delta(live, base, live_at)
+
+# ---------------- SLIDING WINDOW ----------------
+# Per-minute ring buffer of the last WINDOW_HOURS hours so rolling "last 6h" /
+# "last 24h" windows are summed from memory. One ring per channel: an
+# array('I') per egg type the channel has seen, keyed by type id; slot =
+# minute % _WIN_SLOTS, and the ring is advanced (expired slots zeroed) before
+# every add/query. Memory: 4 bytes x 2881 slots = ~11.3 KiB per type seen.
+# Same webhook filter as the index. It is rebuilt from the message index on
+# startup (and after gaps are back-filled) and is only trusted for windows
+# that start after win_valid_since: the oldest point up to which the
+# channel's index is gap-free back from now. Resolution is one minute.
+_WIN_SLOTS = WINDOW_HOURS * 60 + 1
+
+def _win_ring(st: ChannelState, name: str) -> array:
+    tid = type_id(name)
+    arr = st.win_counts.get(tid)
+    if arr is None:
+        arr = st.win_counts[tid] = array("I", bytes(4 * _WIN_SLOTS))
+    return arr
+
+def _win_advance(st: ChannelState, minute: int):
+    if minute <= st.win_head:
+        return
+    steps = min(minute - st.win_head, _WIN_SLOTS)
+    zero = array("I", bytes(4 * steps))
+    start = (st.win_head + 1) % _WIN_SLOTS
+    first = min(steps, _WIN_SLOTS - start)
+    for arr in st.win_counts.values():
+        arr[start:start + first] = zero[:first]
+        if first < steps:
+            arr[0:steps - first] = zero[first:]
+    st.win_head = minute
+
+def window_add(st: ChannelState, ts: float, hits: Dict[str, int]):
+    minute = int(ts // 60)
+    _win_advance(st, minute)
+    if minute <= st.win_head - _WIN_SLOTS:
+        return
+    slot = minute % _WIN_SLOTS
+    for name, n in hits.items():
+        _win_ring(st, name)[slot] += n
+
+def window_forget(name: str):
+    tid = _type_ids.get(name)
+    for st in _channels.values():
+        st.win_counts.pop(tid, None)
+
+def window_totals(st: ChannelState, since: datetime, before: Optional[datetime] = None) -> Optional[Dict[str, int]]:
+    """Totals for [since, before) from memory, or None if the ring can't answer."""
+    now = datetime.now(timezone.utc).timestamp()
+    lo = since.timestamp()
+    if lo < st.win_valid_since or lo < now - WINDOW_HOURS * HOUR:
+        return None
+    _win_advance(st, int(now // 60))
+    first = int(lo // 60)
+    last = int(before.timestamp() // 60) - 1 if before else st.win_head
+    totals = {name: 0 for name in PATTERN_MAP.keys()}
+    if last < first:
+        return totals
+    a, b = first % _WIN_SLOTS, last % _WIN_SLOTS
+    for name in totals:
+        arr = st.win_counts.get(_type_ids.get(name))
+        if arr is not None:
+            totals[name] = sum(arr[a:b + 1]) if a <= b else sum(arr[a:]) + sum(arr[:b + 1])
+    return totals
+
+async def restore_window(st: ChannelState):
+    if _db_conn is None:
+        return
+    async with st.lock:  # no live batch can land between flush and swap
+        await flush_pending_writes([st])
+        now = datetime.now(timezone.utc).timestamp()
+        valid = float("inf")
+        if st.range_id is not None:
+            # the flush just moved the live range's end to now: walk back from it
+            for start, end in sorted(await db_fetchall("SELECT start, end FROM egg_index_ranges WHERE channel_id = ?",
+                                                       (st.channel_id,)),
+                                     key=lambda r: r[1], reverse=True):
+                if end < valid and valid != float("inf"):
+                    break
+                valid = min(valid, start)
+        lo = max(valid, now - WINDOW_HOURS * HOUR) if valid != float("inf") else now
+        rows = await db_fetchall(
+            "SELECT CAST(m.created_at / 60 AS INTEGER), h.type_id, SUM(h.count) "
+            "FROM egg_message_hits h JOIN egg_messages m USING(message_id) "
+            "WHERE m.channel_id = ? AND m.created_at >= ?" +
+            (" AND m.webhook = 1" if ONLY_WEBHOOK else "") + " GROUP BY 1, 2", (st.channel_id, lo))
+        st.win_counts = {}
+        st.win_head = int(now // 60)
+        for minute, tid, cnt in rows:
+            name = type_name(tid)
+            if name is not None and st.win_head - _WIN_SLOTS < minute <= st.win_head:
+                _win_ring(st, name)[minute % _WIN_SLOTS] += cnt
+        st.win_valid_since = valid
+
 # ---------------- UTIL ----------------
 def assign_auto_emoji(name: str) -> str:
     if name in EGG_EMOJIS:
@@ -221,47 +1640,252 @@ def local_midnight(now_utc: datetime) -> datetime:
     start_local = local.replace(hour=0, minute=0, second=0, microsecond=0)
     return start_local - timedelta(hours=TZ_OFFSET)
 # ---------------- LIVE TRACKING (on_message) ----------------
+# on_message only extracts the text and enqueues it on its channel's queue; each
+# channel's ingest_task drains it in micro-batches of up to INGEST_BATCH_MAX
+# messages, counts the whole batch and applies one counter update + one
+# persistence step per batch. ingest_stats are summed over all channels.
+# Raw edit/delete events go through the same queue (so they are applied after
+# the create they correct) and are turned into per-type deltas, see CORRECTIONS.
+ingest_stats = {"enqueued": 0, "processed": 0, "dropped": 0, "batches": 0, "max_depth": 0,
+                "edits": 0, "deletes": 0, "corrections_unknown": 0}
+INGEST_NEW, INGEST_EDIT, INGEST_DELETE = 0, 1, 2
+
+# Auto-detection: one pass of _EGG_TOKEN_RX pulls out only the tokens (runs of
+# [a-z0-9_]) that end or start with "egg"; the rest of the token is the name.
+# Unknown names are candidates in a bounded LRU until AUTO_TYPE_MIN_SIGHTINGS
+# messages mentioned them, so one-off typos never reach PATTERN_MAP (and never
+# slow down every later match). Promoted types are persisted with the next
+# write-behind flush and re-indexed in the background.
+_EGG_TOKEN_RX = re.compile(r"(?<![a-z0-9_])(?:([a-z0-9_]*)egg|egg([a-z0-9_]+))(?![a-z0-9_])", re.A)
+_type_candidates: "OrderedDict[str, int]" = OrderedDict()  # name -> sightings
+
+def _detect_new_types(text: str) -> List[str]:
+    # registers promoted types in memory and queues them for persistence
+    low = text.lower()
+    if "egg" not in low:
+        return []
+    new_types = []
+    for name in {(a or b).strip("_") for a, b in _EGG_TOKEN_RX.findall(low)}:
+        # names need a letter and 2+ chars ("eggs" is not the "s" egg)
+        if len(name) < 2 or name in PATTERN_MAP or not any(c.isalpha() for c in name):
+            continue
+        seen = _type_candidates.pop(name, 0) + 1
+        if seen < AUTO_TYPE_MIN_SIGHTINGS:
+            _type_candidates[name] = seen
+            if len(_type_candidates) > AUTO_TYPE_MAX_CANDIDATES:
+                _type_candidates.popitem(last=False)
+            continue
+        register_pattern(name, re.compile(rf"(?i)\b{re.escape(name)}\b"))
+        assign_auto_emoji(name)
+        new_types.append(name)
+    if new_types:
+        _types_pending.extend(new_types)
+        _flush_wakeup.set()
+    return new_types
+
+@timed("ingest_batch")
+async def _process_ingest_batch(st: ChannelState, items: List[Tuple[int, float, int, bool, str, int]]):
+    corrections = [it for it in items if it[5] != INGEST_NEW]
+    if corrections:
+        items = [it for it in items if it[5] == INGEST_NEW]
+    new_types: List[str] = []
+    for _, _, _, is_bot, text, _ in items:
+        if not is_bot:
+            new_types += _detect_new_types(text)
+    if new_types:
+        client.loop.create_task(reindex_types(new_types))
+
+    rows = []
+    batch_hits: Dict[str, int] = {}
+    for msg_id, created_at, webhook, is_bot, text, _ in items:
+        hits = count_hits(text)
+        counted = 0 if is_bot else 1
+        rows.append((msg_id, created_at, webhook, text, hits, counted))
+        remember_hits(msg_id, created_at, webhook, counted, hits)
+        if counted:
+            for name, n in hits.items():
+                batch_hits[name] = batch_hits.get(name, 0) + n
+
+    async with st.lock:
+        # bot messages are not counted live, but history scans see them
+        # (under the lock so restore_window never misses a batch)
+        for row in rows:
+            note_live_hits(st, row)
+        for name, n in batch_hits.items():
+            # persist today's count (keeps counts across restarts)
+            mark_today_dirty(st, name, st.counts.add(name, n))
+    if corrections:
+        await apply_corrections(st, corrections)
+    ingest_stats["processed"] += len(items) + len(corrections)
+    ingest_stats["batches"] += 1
+
+def _take_ingest_batch(st: ChannelState, first) -> list:
+    items = [first]
+    while len(items) < INGEST_BATCH_MAX:
+        try:
+            items.append(st.queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return items
+
+async def ingest_task(st: ChannelState):
+    while True:
+        items = _take_ingest_batch(st, await st.queue.get())
+        try:
+            await _process_ingest_batch(st, items)
+        except Exception as e:
+            print("Ingest batch failed:", e)
+
+async def drain_ingest():
+    # process whatever is still queued (shutdown)
+    for st in list(_channels.values()):
+        while not st.queue.empty():
+            await _process_ingest_batch(st, _take_ingest_batch(st, st.queue.get_nowait()))
+
+async def _enqueue(st: ChannelState, item: tuple):
+    q = st.queue
+    if q.full():
+        if INGEST_DROP_POLICY == "drop_newest":
+            ingest_stats["dropped"] += 1
+            return
+        if INGEST_DROP_POLICY == "drop_oldest":
+            q.get_nowait()
+            ingest_stats["dropped"] += 1
+    await q.put(item)
+    ingest_stats["enqueued"] += 1
+    ingest_stats["max_depth"] = max(ingest_stats["max_depth"], q.qsize())
+
 @client.event
+@timed("on_message")
 async def on_message(message: discord.Message):
-    if message.author.bot:
-        return
-    if message.channel.id != CHANNEL_ID:
+    st = _channels.get(message.channel.id)
+    if st is None:
         return
 
     text = extract_text(message)
     if not text:
         return
+    await _enqueue(st, (message.id, message.created_at.timestamp(), 1 if message.webhook_id else 0,
+                        message.author.bot, text, INGEST_NEW))
 
-    lowered = text.lower()
-    tokens = re.findall(r"[a-z0-9_]+", lowered)
-
-    # 1) Auto-detect new egg types (persist them)
-    for t in tokens:
-        if t.endswith("egg"):
-            base = t[:-3].strip("_")
-            if base and base not in PATTERN_MAP:
-                pat = rf"(?i)\b{re.escape(base)}\b"
-                PATTERN_MAP[base] = re.compile(pat)
-                egg_counts[base] = 0
-                assign_auto_emoji(base)
-                await persist_type(base, pat, EGG_EMOJIS.get(base))
-        elif t.startswith("egg"):
-            base = t[3:].strip("_")
-            if base and base not in PATTERN_MAP:
-                pat = rf"(?i)\b{re.escape(base)}\b"
-                PATTERN_MAP[base] = re.compile(pat)
-                egg_counts[base] = 0
-                assign_auto_emoji(base)
-                await persist_type(base, pat, EGG_EMOJIS.get(base))
-
-    # 2) Live counting (always)
-    async with counts_lock:
-        for name, rx in PATTERN_MAP.items():
-            hits = rx.findall(text)
-            if hits:
-                egg_counts[name] = egg_counts.get(name, 0) + len(hits)
-                # persist today's count (keeps counts across restarts)
-                await persist_today_count(name, egg_counts[name])
+# raw events: fired for every message, cached by discord.py or not
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    st = _channels.get(payload.channel_id)
+    if st is not None:
+        await _enqueue(st, (payload.message_id, 0.0, 0, False, extract_text(payload.message), INGEST_EDIT))
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    st = _channels.get(payload.channel_id)
+    if st is not None:
+        await _enqueue(st, (payload.message_id, 0.0, 0, False, "", INGEST_DELETE))
+
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    st = _channels.get(payload.channel_id)
+    if st is not None:
+        for msg_id in payload.message_ids:
+            await _enqueue(st, (msg_id, 0.0, 0, False, "", INGEST_DELETE))
+
+# ---------------- CORRECTIONS (edits / deletes) ----------------
+# A correction replaces a message's hits and applies the per-type difference
+# to everything that counted it: today's counters (or the daily row of an older
+# day, if it was counted live), the minute ring, the index and its hourly
+# bucket. Hits of the last EDIT_CACHE_SIZE messages (all channels) stay in an
+# LRU; older ones are read back from the message index in one query per batch,
+# so a correction never needs a history rescan. Messages in neither (sent
+# before the bot saw the channel) are ignored.
+_recent_hits: "OrderedDict[int, Tuple[float, int, int, Dict[str, int]]]" = OrderedDict()
+
+def remember_hits(msg_id: int, created_at: float, webhook: int, counted: int, hits: Dict[str, int]):
+    _recent_hits[msg_id] = (created_at, webhook, counted, hits)
+    _recent_hits.move_to_end(msg_id)
+    if len(_recent_hits) > EDIT_CACHE_SIZE:
+        _recent_hits.popitem(last=False)
+
+async def _load_indexed_hits(msg_ids: List[int]) -> Dict[int, Tuple[float, int, int, Dict[str, int]]]:
+    found: Dict[int, Tuple[float, int, int, Dict[str, int]]] = {}
+    for i in range(0, len(msg_ids), 500):
+        chunk = msg_ids[i:i + 500]
+        rows = await db_fetchall(
+            "SELECT m.message_id, m.created_at, m.webhook, m.counted, h.type_id, h.count "
+            "FROM egg_messages m LEFT JOIN egg_message_hits h USING(message_id) "
+            f"WHERE m.message_id IN ({','.join('?' * len(chunk))})", tuple(chunk))
+        for msg_id, created_at, webhook, counted, tid, cnt in rows:
+            entry = found.setdefault(msg_id, (created_at, webhook, counted, {}))
+            name = type_name(tid) if tid is not None else None
+            if name is not None:
+                entry[3][name] = cnt
+    return found
+
+@timed("corrections")
+async def apply_corrections(st: ChannelState, items: List[Tuple[int, float, int, bool, str, int]]):
+    # the batch's creates (and anything older) must be in the index first
+    await flush_pending_writes([st])
+    known = {it[0]: _recent_hits[it[0]] for it in items if it[0] in _recent_hits}
+    missing = [it[0] for it in items if it[0] not in known]
+    if missing and _db_conn is not None:
+        known.update(await _load_indexed_hits(missing))
+
+    today = local_midnight(datetime.now(timezone.utc)).timestamp()
+    ops: List[Tuple[str, list]] = []
+    buckets = set()
+    past_days = False
+    async with st.lock:
+        for msg_id, _, _, _, text, kind in items:
+            entry = known.get(msg_id)
+            if entry is None:
+                ingest_stats["corrections_unknown"] += 1
+                continue
+            created_at, webhook, counted, old_hits = entry
+            if kind == INGEST_EDIT:
+                ingest_stats["edits"] += 1
+                new_hits = count_hits(text)
+                known[msg_id] = (created_at, webhook, counted, new_hits)
+                if msg_id in _recent_hits:
+                    remember_hits(msg_id, created_at, webhook, counted, new_hits)
+                ops.append(("UPDATE egg_messages SET text = ? WHERE message_id = ?", [(_stored_text(webhook, text), msg_id)]))
+            else:
+                ingest_stats["deletes"] += 1
+                new_hits = {}
+                known.pop(msg_id)
+                _recent_hits.pop(msg_id, None)
+                ops.append(("DELETE FROM egg_message_hits WHERE message_id = ?", [(msg_id,)]))
+                ops.append(("DELETE FROM egg_messages WHERE message_id = ?", [(msg_id,)]))
+            delta = {name: new_hits.get(name, 0) - old_hits.get(name, 0) for name in set(old_hits) | set(new_hits)}
+            delta = {name: d for name, d in delta.items() if d}
+            if not delta:
+                continue
+
+            buckets.add(int(created_at // HOUR) * HOUR)
+            if kind == INGEST_EDIT:
+                ops.append(("DELETE FROM egg_message_hits WHERE message_id = ?", [(msg_id,)]))
+                ops.append(("INSERT INTO egg_message_hits(message_id, type_id, count) VALUES(?, ?, ?)",
+                            [(msg_id, type_id(name), n) for name, n in new_hits.items()]))
+            if counted and created_at >= today:
+                for name, d in delta.items():
+                    mark_today_dirty(st, name, st.counts.add(name, max(d, -st.counts.get(name))))
+            elif counted:
+                past_days = True
+                day = local_midnight(datetime.fromtimestamp(created_at, timezone.utc)).date().isoformat()
+                ops.append(("INSERT INTO egg_counts_daily(channel_id, date, type_id, count) VALUES(?, ?, ?, ?) "
+                            "ON CONFLICT(channel_id, date, type_id) DO UPDATE SET count = MAX(count + ?, 0)",
+                            [(st.channel_id, day, type_id(name), max(d, 0), d) for name, d in delta.items()]))
+            if not ONLY_WEBHOOK or webhook:
+                minute = int(created_at // 60)
+                _win_advance(st, int(datetime.now(timezone.utc).timestamp() // 60))
+                if minute > st.win_head - _WIN_SLOTS:
+                    slot = minute % _WIN_SLOTS
+                    for name, d in delta.items():
+                        ring = _win_ring(st, name)
+                        ring[slot] = max(ring[slot] + d, 0)
+        if ops:
+            await db_write_batch(ops + _rollup_ops(st.channel_id, buckets))
+    # cached totals (and the live top-up they were pinned to) predate the correction
+    invalidate_query_cache(st.channel_id)
+    if past_days:
+        _stats_cache.pop(st.channel_id, None)
 
 # ---------------- DAILY REPORT + CLEANUP TASK ----------------
 async def daily_report_task():
@@ -279,39 +1903,66 @@ async def daily_report_task():
         if wait <= 0:
             wait = 1
         await asyncio.sleep(wait)
+        await _daily_rollover(user, next_mid)
 
-        # snapshot & embed
-        async with counts_lock:
-            snapshot = dict(egg_counts)
-        embed = discord.Embed(title="📊 Daily Egg Report", color=EMBED_COLOR, timestamp=datetime.now(timezone.utc))
-        total = 0
-        for name in sorted(snapshot.keys()):
-            v = snapshot[name]; total += v
-            embed.add_field(name=f"{EGG_EMOJIS.get(name,'🥚')} {label_for_type(name)}", value=str(v), inline=True)
-        embed.add_field(name="TOTAL", value=str(total), inline=False)
+@timed("daily_report")
+async def _daily_rollover(user: Optional[discord.User], next_mid: datetime):
+    # make sure the day's live counts are on disk before rolling over
+    await flush_pending_writes()
 
-        if user:
-            try:
-                await user.send(embed=embed)
-            except Exception as e:
-                print("Daily DM failed:", e)
+    # Snapshot and reset together: each channel's counters are swapped for fresh
+    # ones under its lock, and the finished day is stored (and today's rows
+    # cleared) in the same commit before any lock is released, so nothing the
+    # ingest consumer counts is lost from both days. DMs and retention run after.
+    states = list(_channels.values())
+    snapshots: Dict[int, TypeCounters] = {}
+    date_for = (next_mid - timedelta(days=1)).date().isoformat()
+    async with contextlib.AsyncExitStack() as stack:
+        for st in states:
+            await stack.enter_async_context(st.lock)
+            if RESET_AFTER_REPORT:
+                snapshots[st.channel_id], st.counts = st.counts, TypeCounters()
+                st.dirty.clear()
+            else:
+                snapshots[st.channel_id] = st.counts.copy()
+        ops = _daily_total_ops(date_for, snapshots)
+        if RESET_AFTER_REPORT:
+            ops.append(("DELETE FROM egg_counts_today WHERE channel_id = ?", [(st.channel_id,) for st in states]))
+        await db_write_batch(ops)
 
-        # persist daily totals for the day we just finished
-        date_for = (next_mid - timedelta(days=1)).date().isoformat()
-        await persist_daily_totals(date_for, snapshot)
+    # one combined report: per-type totals over all channels, plus each channel's total
+    embed = discord.Embed(title="📊 Daily Egg Report", color=EMBED_COLOR, timestamp=datetime.now(timezone.utc))
+    total = 0
+    for name in sorted(PATTERN_MAP.keys()):
+        v = sum(snapshot.get(name) for snapshot in snapshots.values()); total += v
+        embed.add_field(name=f"{EGG_EMOJIS.get(name,'🥚')} {label_for_type(name)}", value=str(v), inline=True)
+    if len(states) > 1:
+        lines = []
+        for st in sorted(states, key=lambda s: -sum(snapshots[s.channel_id].values())):
+            ch = client.get_channel(st.channel_id)
+            lines.append(f"{f'#{ch.name}' if ch is not None else st.channel_id}: {sum(snapshots[st.channel_id].values())}")
+        value = "\n".join(lines)
+        if len(value) > 1024:  # embed field limit
+            value = value[:1000].rsplit("\n", 1)[0] + f"\n… {len(states)} channels"
+        embed.add_field(name="Channels", value=value, inline=False)
+    embed.add_field(name="TOTAL", value=str(total), inline=False)
 
-        # cleanup old rows
-        await cleanup_old_daily_rows(KEEP_DAYS)
+    if user:
+        try:
+            await user.send(embed=embed)
+        except Exception as e:
+            print("Daily DM failed:", e)
 
-        # reset today's counts (if configured)
-        if RESET_AFTER_REPORT:
-            async with counts_lock:
-                for k in list(egg_counts.keys()):
-                    egg_counts[k] = 0
-            await db_execute("DELETE FROM egg_counts_today")
-            # re-persist types metadata to ensure nothing lost
-            for name, rx in PATTERN_MAP.items():
-                await persist_type(name, rx.pattern, EGG_EMOJIS.get(name))
+    # cleanup old rows
+    await cleanup_old_daily_rows(KEEP_DAYS)
+    # "today" and the rollup/index bounds moved
+    invalidate_query_cache()
+    _stats_cache.clear()
+
+    if RESET_AFTER_REPORT:
+        # re-persist types metadata to ensure nothing lost
+        for name, rx in PATTERN_MAP.items():
+            await persist_type(name, rx.pattern, EGG_EMOJIS.get(name))
 
 # ---------------- COMMANDS ----------------
 @tree.command(
@@ -326,24 +1977,28 @@ async def egg_cmd(
     when: Optional[str] = None
 ):
     await interaction.response.defer(thinking=True)
+    st = state_for(interaction)
+    if st is None:
+        await interaction.followup.send("No tracked channel in this server.")
+        return
     et = egg_type.value if egg_type else "all"
     now = datetime.now(timezone.utc)
     s = (when or "").strip().lower()
 
     # TODAY -> live fast
     if s == "" or "today" in s:
-        async with counts_lock:
+        async with st.lock:
             if et == "all":
                 embed = discord.Embed(title="🥚 Today's Egg Breakdown", color=EMBED_COLOR)
                 total = 0
-                for name, value in egg_counts.items():
+                for name, value in st.counts.items():
                     embed.add_field(name=f"{EGG_EMOJIS.get(name,'🥚')} {label_for_type(name)}", value=str(value), inline=True)
                     total += value
                 embed.add_field(name="TOTAL", value=str(total), inline=False)
                 await interaction.followup.send(embed=embed)
                 return
             else:
-                value = egg_counts.get(et, 0)
+                value = st.counts.get(et, 0)
                 embed = discord.Embed(title=f"{EGG_EMOJIS.get(et,'🥚')} {label_for_type(et)} (today)", color=EMBED_COLOR)
                 embed.add_field(name="Count", value=str(value))
                 await interaction.followup.send(embed=embed)
@@ -370,16 +2025,19 @@ async def egg_cmd(
 
     since, label = parse_when(s)
 
-    ch = client.get_channel(CHANNEL_ID)
+    ch = client.get_channel(st.channel_id)
     if ch is None:
         await interaction.followup.send("Channel not found.")
         return
 
     if label == "all time":
-        rows = await db_fetchall("SELECT egg_type, SUM(count) FROM egg_counts_daily GROUP BY egg_type")
+        rows = await db_fetchall("SELECT type_id, SUM(count) FROM egg_counts_daily WHERE channel_id = ? GROUP BY type_id",
+                                 (st.channel_id,))
         totals = {name: 0 for name in PATTERN_MAP.keys()}
-        for r in rows:
-            totals[r[0]] = r[1] or 0
+        for tid, cnt in rows:
+            name = type_name(tid)
+            if name is not None:
+                totals[name] = cnt or 0
         total = sum(totals.values())
         embed = discord.Embed(title="🥚 All-time Egg Totals", color=EMBED_COLOR)
         for name, val in totals.items():
@@ -388,9 +2046,11 @@ async def egg_cmd(
         await interaction.followup.send(embed=embed)
         return
 
-    # run history scans (full scan between since -> now)
+    # answer from hourly rollups + message index (only uncovered gaps hit Discord)
+    totals = window_totals(st, since)
+    if totals is None:
+        totals = await cached_range_totals(ch, ("open", label), since, None)
     if et == "all":
-        totals = await fast_count_all(ch, since, None)
         total = sum(totals.values())
         embed = discord.Embed(title=f"🥚 Egg Count ({label})", color=EMBED_COLOR)
         for name, val in totals.items():
@@ -398,7 +2058,7 @@ async def egg_cmd(
         embed.add_field(name="TOTAL", value=str(total), inline=False)
         await interaction.followup.send(embed=embed)
     else:
-        cnt = await fast_count_single(ch, since, None, PATTERN_MAP[et])
+        cnt = totals.get(et, 0)
         embed = discord.Embed(title=f"{EGG_EMOJIS.get(et,'🥚')} {label_for_type(et)} ({label})", color=EMBED_COLOR)
         embed.add_field(name="Count", value=str(cnt))
         await interaction.followup.send(embed=embed)
@@ -407,17 +2067,23 @@ async def egg_cmd(
 @tree.command(name="egg_trend", description="Compare today's total vs yesterday.")
 async def egg_trend(interaction: discord.Interaction):
     await interaction.response.defer(thinking=True)
+    st = state_for(interaction)
+    if st is None:
+        await interaction.followup.send("No tracked channel in this server.")
+        return
     now = datetime.now(timezone.utc)
     today_start = local_midnight(now)
     yesterday_start = today_start - timedelta(days=1)
-    today_total = sum(egg_counts.values())
+    today_total = sum(st.counts.values())
 
-    ch = client.get_channel(CHANNEL_ID)
+    ch = client.get_channel(st.channel_id)
     if ch is None:
         await interaction.followup.send("Channel not found.")
         return
 
-    yesterday_totals = await fast_count_all(ch, yesterday_start, today_start)
+    yesterday_totals = window_totals(st, yesterday_start, today_start)
+    if yesterday_totals is None:
+        yesterday_totals = await cached_range_totals(ch, ("range", yesterday_start, today_start), yesterday_start, today_start)
     yesterday_total = sum(yesterday_totals.values())
     diff = today_total - yesterday_total
     emoji = "📈" if diff >= 0 else "📉"
@@ -425,6 +2091,126 @@ async def egg_trend(interaction: discord.Interaction):
                           description=f"**Today:** {today_total}\n**Yesterday:** {yesterday_total}\n\n**Trend:** {emoji} {abs(diff)} eggs")
     await interaction.followup.send(embed=embed)
 
+# ---------------- /egg_stats ----------------
+# Analytics over the stored daily totals of finished days. The channel's
+# egg_counts_daily rows are pulled once into one array('q') column per type
+# (one slot per stored day) and the hourly rollup into a 24-slot hour-of-day
+# column; moving averages come from prefix sums (accumulate + map over slices,
+# no per-day Python loop). Finished days only change at the rollover, so a
+# result is kept until the local day changes (or a backfill / past-day
+# correction rewrites daily rows).
+STATS_WINDOW_DAYS = 7
+_stats_cache: Dict[int, Tuple[float, dict]] = {}  # channel id -> (day start, stats)
+
+def _moving_avg(col: array, n: int) -> List[float]:
+    # trailing n-day means, one per day from the n-th on
+    acc = array("q", accumulate(col, initial=0))
+    return [d / n for d in map(operator.sub, acc[n:], acc[:-n])]
+
+def _percentile(sorted_vals: List[int], p: int) -> int:
+    # nearest rank
+    return sorted_vals[max(0, min(len(sorted_vals) - 1, -(-len(sorted_vals) * p // 100) - 1))]
+
+async def compute_stats(st: ChannelState, today_start: datetime) -> dict:
+    rows = await db_fetchall("SELECT date, type_id, count FROM egg_counts_daily WHERE channel_id = ? AND date < ?",
+                             (st.channel_id, today_start.date().isoformat()))
+    col = "webhook_count" if ONLY_WEBHOOK else "count"
+    hourly = await db_fetchall(f"SELECT bucket_start, SUM({col}) FROM egg_counts_hourly "
+                               "WHERE channel_id = ? AND bucket_start < ? GROUP BY 1",
+                               (st.channel_id, today_start.timestamp()))
+
+    dates = sorted({r[0] for r in rows})
+    pos = {d: i for i, d in enumerate(dates)}
+    cols: Dict[str, array] = {}
+    for date, tid, cnt in rows:
+        name = type_name(tid)
+        if name is None:
+            continue
+        c = cols.get(name)
+        if c is None:
+            c = cols[name] = array("q", bytes(8 * len(dates)))
+        c[pos[date]] += cnt
+    totals = array("q", map(sum, zip(*cols.values()))) if cols else array("q")
+    # slot = local hour the UTC bucket starts in; with a fractional TZ_OFFSET every
+    # bucket starts the same number of minutes past it (5.5 -> HH:30)
+    by_hour = array("q", bytes(8 * 24))
+    for bucket, n in hourly:
+        by_hour[int((bucket + TZ_OFFSET * HOUR) // HOUR) % 24] += n
+    minute = int(round(TZ_OFFSET * 60)) % 60
+
+    stats = {"days": len(dates), "hours": sorted(((n, f"{h:02d}:{minute:02d}") for h, n in enumerate(by_hour) if n),
+                                                 reverse=True)[:3]}
+    if not dates:
+        return stats
+    ranked = sorted(totals)
+    grand = sum(totals)
+    w = min(STATS_WINDOW_DAYS, len(dates) // 2)
+    best = max(range(len(dates)), key=totals.__getitem__)
+    stats.update(first=dates[0], last=dates[-1], avg=grand / len(dates),
+                 p50=_percentile(ranked, 50), p90=_percentile(ranked, 90), best=(dates[best], totals[best]))
+    if w:
+        ma = _moving_avg(totals, w)
+        stats.update(window=w, ma=ma[-1], ma_prev=ma[-1 - w])
+    types = []
+    for name, c in cols.items():
+        n = sum(c)
+        if not n:
+            continue
+        growth = None
+        if w:
+            cur, prev = sum(c[-w:]), sum(c[-2 * w:-w])
+            growth = (cur - prev) / prev if prev else None
+        types.append((n / grand, name, growth))
+    stats["types"] = sorted(types, reverse=True)
+    return stats
+
+async def cached_stats(st: ChannelState) -> dict:
+    today_start = local_midnight(datetime.now(timezone.utc))
+    entry = _stats_cache.get(st.channel_id)
+    if entry and entry[0] == today_start.timestamp():
+        return entry[1]
+    stats = await compute_stats(st, today_start)
+    _stats_cache[st.channel_id] = (today_start.timestamp(), stats)
+    return stats
+
+def _pct(x: Optional[float]) -> str:
+    return "new" if x is None else f"{x * 100:+.0f}%"
+
+@tree.command(name="egg_stats", description="Averages, percentiles, per-type growth and peak hours of past days")
+async def egg_stats(interaction: discord.Interaction):
+    await interaction.response.defer(thinking=True)
+    st = state_for(interaction)
+    if st is None:
+        await interaction.followup.send("No tracked channel in this server.")
+        return
+    stats = await cached_stats(st)
+    if not stats["days"]:
+        await interaction.followup.send("No stored daily totals yet.")
+        return
+
+    embed = discord.Embed(title="📈 Egg Stats", color=EMBED_COLOR,
+                          description=f"{stats['days']} stored days, {stats['first']} → {stats['last']}")
+    embed.add_field(name="Per day", value=f"avg {stats['avg']:.1f}\np50 {stats['p50']} · p90 {stats['p90']}\n"
+                                          f"best {stats['best'][1]} ({stats['best'][0]})", inline=True)
+    if "window" in stats:
+        w = stats["window"]
+        change = (stats["ma"] - stats["ma_prev"]) / stats["ma_prev"] if stats["ma_prev"] else None
+        embed.add_field(name=f"{w}-day average", value=f"{stats['ma']:.1f}/day\n"
+                                                       f"previous {w} days: {stats['ma_prev']:.1f} ({_pct(change)})",
+                        inline=True)
+    if stats["hours"]:
+        embed.add_field(name="Peak hours", value="\n".join(f"{h} — {n}" for n, h in stats["hours"]), inline=True)
+    lines = []
+    for share, name, growth in stats["types"][:10]:
+        line = f"{EGG_EMOJIS.get(name, '🥚')} {label_for_type(name)}: {share * 100:.1f}%"
+        if "window" in stats:
+            line += f" ({_pct(growth)})"
+        lines.append(line)
+    if lines:
+        embed.add_field(name="Share" + (f" (growth, last {stats['window']} days)" if "window" in stats else ""),
+                        value="\n".join(lines), inline=False)
+    await interaction.followup.send(embed=embed)
+
 # ---------------- ADMIN (add/remove/setemoji/reset) ----------------
 def is_admin_interaction(interaction: discord.Interaction) -> bool:
     try:
@@ -433,11 +2219,18 @@ def is_admin_interaction(interaction: discord.Interaction) -> bool:
     except Exception:
         return False
 
+def is_owner_interaction(interaction: discord.Interaction) -> bool:
+    # global changes (egg types) and process-wide stats: admins of ADMIN_GUILD_ID only
+    # (a bare first channel id: its guild, once the gateway reported it)
+    first = _channels.get(CHANNEL_ID)
+    guild_id = ADMIN_GUILD_ID or (first.guild_id if first else 0)
+    return bool(guild_id) and is_admin_interaction(interaction) and interaction.guild_id == guild_id
+
 @tree.command(name="egg_addtype", description="(Admin) Add new egg type")
 @app_commands.describe(name="internal name (no spaces)", pattern="regex pattern (eg (?i)crystal)", emoji="optional emoji")
 async def egg_addtype(interaction: discord.Interaction, name: str, pattern: str, emoji: Optional[str] = None):
-    if not is_admin_interaction(interaction):
-        await interaction.response.send_message("Admin only.", ephemeral=True)
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
         return
     if name in PATTERN_MAP:
         await interaction.response.send_message(f"{name} already exists.", ephemeral=True)
@@ -447,38 +2240,47 @@ async def egg_addtype(interaction: discord.Interaction, name: str, pattern: str,
     except re.error as e:
         await interaction.response.send_message(f"Invalid regex: {e}", ephemeral=True)
         return
-    PATTERN_MAP[name] = rx
-    egg_counts[name] = 0
+    register_pattern(name, rx)
     if emoji:
         EGG_EMOJIS[name] = emoji
     else:
         assign_auto_emoji(name)
     await persist_type(name, pattern, EGG_EMOJIS.get(name))
-    await persist_today_count(name, 0)
+    _type_candidates.pop(name, None)
+    client.loop.create_task(reindex_types([name]))
     await interaction.response.send_message(f"Added `{name}`.", ephemeral=True)
 
 @tree.command(name="egg_removetype", description="(Admin) Remove egg type")
 @app_commands.describe(name="internal name")
 async def egg_removetype(interaction: discord.Interaction, name: str):
-    if not is_admin_interaction(interaction):
-        await interaction.response.send_message("Admin only.", ephemeral=True)
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
         return
     if name not in PATTERN_MAP:
         await interaction.response.send_message(f"{name} not found.", ephemeral=True)
         return
-    PATTERN_MAP.pop(name, None)
-    egg_counts.pop(name, None)
+    tid = type_id(name)
+    unregister_pattern(name)
+    for st in _channels.values():
+        st.counts.pop(name, None)
+        st.dirty.pop(tid, None)
     EGG_EMOJIS.pop(name, None)
-    await db_execute("DELETE FROM egg_types WHERE name = ?", (name,))
-    await db_execute("DELETE FROM egg_counts_today WHERE egg_type = ?", (name,))
-    await db_execute("DELETE FROM egg_counts_daily WHERE egg_type = ?", (name,))
+    await db_write_batch([
+        ("DELETE FROM egg_types WHERE id = ?", [(tid,)]),
+        ("DELETE FROM egg_counts_today WHERE type_id = ?", [(tid,)]),
+        ("DELETE FROM egg_counts_daily WHERE type_id = ?", [(tid,)]),
+        ("DELETE FROM egg_message_hits WHERE type_id = ?", [(tid,)]),
+        ("DELETE FROM egg_counts_hourly WHERE type_id = ?", [(tid,)]),
+    ])
+    window_forget(name)
+    invalidate_query_cache()
     await interaction.response.send_message(f"Removed `{name}`.", ephemeral=True)
 
 @tree.command(name="egg_setemoji", description="(Admin) Set emoji")
 @app_commands.describe(name="internal name", emoji="emoji to set")
 async def egg_setemoji(interaction: discord.Interaction, name: str, emoji: str):
-    if not is_admin_interaction(interaction):
-        await interaction.response.send_message("Admin only.", ephemeral=True)
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
         return
     if name not in PATTERN_MAP:
         await interaction.response.send_message(f"{name} not found.", ephemeral=True)
@@ -493,49 +2295,274 @@ async def egg_reset(interaction: discord.Interaction, name: Optional[str] = None
     if not is_admin_interaction(interaction):
         await interaction.response.send_message("Admin only.", ephemeral=True)
         return
-    async with counts_lock:
+    st = state_for(interaction)
+    if st is None:
+        await interaction.response.send_message("No tracked channel in this server.", ephemeral=True)
+        return
+    async with st.lock:
         if name:
-            if name not in egg_counts:
+            if name not in st.counts:
                 await interaction.response.send_message(f"{name} not found.", ephemeral=True)
                 return
-            egg_counts[name] = 0
-            await persist_today_count(name, 0)
+            st.counts[name] = 0
+            mark_today_dirty(st, name, 0)
             await interaction.response.send_message(f"Reset {name}.", ephemeral=True)
         else:
-            for k in list(egg_counts.keys()):
-                egg_counts[k] = 0
-                await persist_today_count(k, 0)
+            st.counts.zero()
+            for k in PATTERN_MAP:
+                mark_today_dirty(st, k, 0)
             await interaction.response.send_message("Reset all counts.", ephemeral=True)
 
-# ---------------- ON_READY ----------------
+@tree.command(name="egg_cache", description="(Admin) Query cache stats")
+async def egg_cache(interaction: discord.Interaction):
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
+        return
+    st = query_cache_stats
+    lookups = st["hits"] + st["misses"] + st["shared"]
+    rate = (st["hits"] + st["shared"]) / lookups * 100 if lookups else 0.0
+    embed = discord.Embed(title="🗃️ Query Cache", color=EMBED_COLOR)
+    embed.add_field(name="Hits", value=str(st["hits"]), inline=True)
+    embed.add_field(name="Shared in-flight", value=str(st["shared"]), inline=True)
+    embed.add_field(name="Misses", value=str(st["misses"]), inline=True)
+    embed.add_field(name="Hit rate", value=f"{rate:.1f}%", inline=True)
+    embed.add_field(name="Entries", value=str(len(_query_cache)), inline=True)
+    embed.add_field(name="Invalidations", value=str(st["invalidations"]), inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name="egg_queue", description="(Admin) Live ingest queue stats")
+async def egg_queue(interaction: discord.Interaction):
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
+        return
+    st = ingest_stats
+    depths = [c.queue.qsize() for c in _channels.values()]
+    embed = discord.Embed(title="📥 Ingest Queue", color=EMBED_COLOR)
+    embed.add_field(name="Depth", value=f"{sum(depths)} (max {max(depths, default=0)}/{INGEST_QUEUE_MAX} "
+                                        f"over {len(depths)} channels)", inline=True)
+    embed.add_field(name="Max depth", value=str(st["max_depth"]), inline=True)
+    embed.add_field(name="Dropped", value=f"{st['dropped']} ({INGEST_DROP_POLICY})", inline=True)
+    embed.add_field(name="Processed", value=str(st["processed"]), inline=True)
+    embed.add_field(name="Batches", value=str(st["batches"]), inline=True)
+    avg = st["processed"] / st["batches"] if st["batches"] else 0.0
+    embed.add_field(name="Avg batch", value=f"{avg:.1f}", inline=True)
+    embed.add_field(name="Corrections", value=f"{st['edits']} edits, {st['deletes']} deletes "
+                    f"({st['corrections_unknown']} unknown)", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name="egg_stats_internal", description="(Admin) Hot-path timers and queue depths")
+async def egg_stats_internal(interaction: discord.Interaction):
+    if not is_owner_interaction(interaction):
+        await interaction.response.send_message("Admin only (bot admin server).", ephemeral=True)
+        return
+    embed = discord.Embed(title="⏱️ Internal Stats", color=EMBED_COLOR)
+    embed.add_field(name="Channels", value=str(len(_channels)), inline=True)
+    embed.add_field(name="Ingest queue", value=str(sum(c.queue.qsize() for c in _channels.values())), inline=True)
+    embed.add_field(name="DB write queue", value=str(_db_write_queue.qsize()), inline=True)
+    embed.add_field(name="DB reads in flight", value=str(_db_reads_in_flight), inline=True)
+    st = startup_stats
+    embed.add_field(name="Cold start", value=f"ready {st['ready_s']:.2f}s (setup {st['setup_s']:.2f}s, "
+                    f"sync {'ran' if st['synced'] else 'skipped'} {st['sync_s']:.2f}s)", inline=False)
+    embed.add_field(name="Reconnects", value=str(st["reconnects"]), inline=True)
+    if not METRICS_ENABLED:
+        embed.description = "Timers are off; set METRICS_ENABLED=1 to collect them."
+    else:
+        with _metric_lock:
+            timers = sorted(_metric_timers.items())
+        for name, (count, total, mx) in timers[:19]:  # embeds hold 25 fields, 6 are used above
+            embed.add_field(name=name, value=f"n={count:.0f} avg={total / count * 1000:.2f}ms max={mx * 1000:.1f}ms", inline=True)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+@tree.command(name="egg_backfill", description="(Admin) Backfill channel history into the index, or show progress")
+@app_commands.describe(days="Start a new job this many days back (max: retention window); omit to resume or show progress")
+async def egg_backfill(interaction: discord.Interaction, days: Optional[int] = None):
+    if not is_admin_interaction(interaction):
+        await interaction.response.send_message("Admin only.", ephemeral=True)
+        return
+    state = state_for(interaction)
+    if state is None:
+        await interaction.response.send_message("No tracked channel in this server.", ephemeral=True)
+        return
+    ch = client.get_channel(state.channel_id)
+    started = await start_backfill(ch, days) if ch else False
+    st = state.backfill_stats
+    embed = discord.Embed(title="🗄️ Backfill", color=EMBED_COLOR,
+                          description="Started." if started else f"State: {st['state']}")
+    if st["lo"] is not None:
+        span = max(st["hi"] - st["lo"], 1.0)
+        done = 100.0 if st["state"] == "done" else min(100.0, (st["cursor"] - st["lo"]) / span * 100)
+        embed.add_field(name="Progress", value=f"{done:.1f}%", inline=True)
+        embed.add_field(name="Messages", value=str(st["messages"]), inline=True)
+        rate = st["run_messages"] / st["elapsed"] if st["elapsed"] else 0.0
+        embed.add_field(name="Throughput", value=f"~{rate:.0f} msg/s", inline=True)
+        embed.add_field(name="Cursor", value=f"<t:{int(st['cursor'])}:f>", inline=True)
+    if st["error"]:
+        embed.add_field(name="Last error", value=st["error"][:1000], inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+# ---------------- STARTUP ----------------
+# setup_hook runs once per process, after login and before the gateway
+# connects: DB, state, background tasks and the command sync. Live coverage
+# ranges are only opened once the gateway delivers messages: on_ready (and
+# on_shard_ready, as each shard finishes identifying) and on_resumed, which
+# fire again on every reconnect and resync what a disconnect breaks (the
+# ranges and the minute rings). With an AutoShardedClient the per-shard events
+# do that for the channels of the shard's guilds only.
+# The command tree is synced only when the hash of its payload differs from
+# the last synced one.
+startup_stats = {"setup_s": 0.0, "sync_s": 0.0, "synced": 0, "ready_s": 0.0, "reconnects": 0}
+_boot_started = time.perf_counter()
+_report_task: Optional[asyncio.Task] = None
+
+def command_tree_hash(guild: Optional[discord.abc.Snowflake]) -> str:
+    payload = []
+    for cmd in tree.get_commands(guild=guild):
+        try:
+            payload.append(cmd.to_dict(tree))
+        except TypeError:  # discord.py < 2.4
+            payload.append(cmd.to_dict())
+    blob = json.dumps([guild.id if guild else None, sorted(payload, key=lambda c: (c.get("type", 1), c["name"]))],
+                      sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+async def sync_commands_if_changed(guild: Optional[discord.abc.Snowflake]) -> bool:
+    digest = command_tree_hash(guild)
+    rows = await db_fetchall("SELECT value FROM egg_meta WHERE key = 'command_hash'")
+    if rows and rows[0][0] == digest:
+        return False
+    await tree.sync(guild=guild)
+    await db_execute("INSERT OR REPLACE INTO egg_meta(key, value) VALUES('command_hash', ?)", (digest,))
+    return True
+
+async def attach_channel(guild_id: int, channel_id: int) -> ChannelState:
+    """Start tracking a channel: load its counts and start its ingest task.
+    Its live range is opened by resync_channels once its shard is connected."""
+    st = _channels.get(channel_id)
+    if st is not None:
+        return st
+    st = _channels[channel_id] = ChannelState(guild_id, channel_id)
+    await load_today_counts(st)
+    st.ingest_task = client.loop.create_task(ingest_task(st))
+    return st
+
+async def attach_visible_channels():
+    # channels configured without a guild id: tracked once this process's shards see them
+    for guild_id, channel_id in CHANNELS:
+        if guild_id or channel_id in _channels:
+            continue
+        ch = client.get_channel(channel_id)
+        if ch is not None and getattr(ch, "guild", None) is not None:
+            await attach_channel(ch.guild.id, channel_id)
+
+def shard_states(shard_id: Optional[int]) -> List[ChannelState]:
+    # channels of the guilds on one shard; all of them for None
+    if shard_id is None or not client.shard_count:
+        return list(_channels.values())
+    return [st for st in _channels.values() if (st.guild_id >> 22) % client.shard_count == shard_id]
+
+async def resync_channels(states: List[ChannelState]):
+    # new gateway session: reopen live ranges, resume interrupted backfills
+    for st in states:
+        if await open_index_range(st):
+            await restore_window(st)
+        ch = client.get_channel(st.channel_id)
+        if ch is not None:
+            await start_backfill(ch)
+
+async def close_channel_ranges(states: List[ChannelState]):
+    # messages may be missed until we're back; gaps get fetched on demand
+    if _db_conn is not None:
+        for st in states:
+            await close_index_range(st)
+
 @client.event
-async def on_ready():
-    print(f"Logged in as {client.user} - initializing DB and loading state...")
+async def setup_hook():
+    global _flush_task, _retention_task, _report_task
+    t0 = time.perf_counter()
+    print("Initializing DB and loading state...")
     await db_init()
     await load_persisted_types()
-    await load_today_counts()
-    # ensure egg_counts contains persisted types
-    async with counts_lock:
-        for k in PATTERN_MAP.keys():
-            egg_counts.setdefault(k, 0)
-
     # start background tasks
     # preload disabled intentionally (avoids startup lag)
-    client.loop.create_task(daily_report_task())
+    if _report_task is None or _report_task.done():
+        _report_task = client.loop.create_task(daily_report_task())
+    if _flush_task is None or _flush_task.done():
+        _flush_task = client.loop.create_task(persist_flush_task())
+    if _retention_task is None or _retention_task.done():
+        _retention_task = client.loop.create_task(retention_task())
+    for guild_id, channel_id in CHANNELS:
+        if guild_id and is_local_guild(guild_id):
+            await attach_channel(guild_id, channel_id)
+    startup_stats["setup_s"] = time.perf_counter() - t0
 
-    guild = discord.Object(id=GUILD_ID)
-    tree.copy_global_to(guild=guild)
-    await tree.sync(guild=guild)
+    t0 = time.perf_counter()
+    guild = discord.Object(id=GUILD_ID) if GUILD_ID else None
+    if guild is not None:
+        tree.copy_global_to(guild=guild)
+    try:
+        startup_stats["synced"] = int(await sync_commands_if_changed(guild))
+    except Exception as e:
+        # the previously synced commands keep working; retried on next start
+        print("Command sync failed:", e)
+    startup_stats["sync_s"] = time.perf_counter() - t0
+
+@client.event
+async def on_ready():
+    if startup_stats["ready_s"]:
+        # new gateway session after a disconnect: state in memory is still good
+        startup_stats["reconnects"] += 1
+    else:
+        startup_stats["ready_s"] = time.perf_counter() - _boot_started
+        print(f"Logged in as {client.user} - ready in {startup_stats['ready_s']:.2f}s "
+              f"(setup {startup_stats['setup_s']:.2f}s, commands "
+              f"{'synced' if startup_stats['synced'] else 'unchanged'} {startup_stats['sync_s']:.2f}s)")
+    await attach_visible_channels()
+    await resync_channels(shard_states(None))
     await client.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="ur eggs"))
-    print("Initialization complete. LIVE tracking active. History enabled.")
+    print(f"LIVE tracking active in {len(_channels)} channel(s). History enabled.")
+
+@client.event
+async def on_disconnect():
+    if not SHARDED:  # shards report their own disconnects below
+        await close_channel_ranges(shard_states(None))
+
+@client.event
+async def on_resumed():
+    if not SHARDED and _db_conn is not None:
+        await resync_channels(shard_states(None))
+
+@client.event
+async def on_shard_disconnect(shard_id: int):
+    await close_channel_ranges(shard_states(shard_id))
+
+@client.event
+async def on_shard_ready(shard_id: int):
+    # the shard's guilds deliver messages from now on; on_ready covers the rest
+    if startup_stats["ready_s"]:
+        # one shard re-identified after the initial on_ready
+        startup_stats["reconnects"] += 1
+    await attach_visible_channels()
+    await resync_channels(shard_states(shard_id))
+
+@client.event
+async def on_shard_resumed(shard_id: int):
+    if _db_conn is not None:
+        await resync_channels(shard_states(shard_id))
 
 # ---------------- RUN ----------------
 async def main():
+    global _boot_started
+    _boot_started = time.perf_counter()
     try:
+        await start_metrics_server()
         async with client:
             await client.start(TOKEN)
     finally:
+        await stop_metrics_server()
+        await drain_ingest()
+        await flush_pending_writes()
         await db_close()
+        shutdown_match_pool()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,32 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# main.py reads its config at import time
+os.environ.setdefault("DISCORD_TOKEN", "test")
+os.environ.setdefault("CHANNEL_ID", "1")
+os.environ.setdefault("GUILD_ID", "1")
+os.environ["ONLY_WEBHOOK"] = "0"
+os.environ["TZ_OFFSET_HOURS"] = "0"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Run a coroutine against a fresh database: db(coro) -> its result."""
+    monkeypatch.setattr(main, "DB_PATH", str(tmp_path / "eggs.db"))
+
+    def run(coro):
+        async def wrapped():
+            await main.db_init()
+            try:
+                return await coro
+            finally:
+                await main.db_close()
+        return asyncio.run(wrapped())
+    return run
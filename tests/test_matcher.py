@@ -0,0 +1,70 @@
+import random
+import re
+
+import pytest
+
+import main
+
+CUSTOM_PATTERNS = {
+    "egg_number": r"(?i)egg\s*\d+",
+    "firefly": r"(?i)\bfire(?:fly)?\b",
+    "dragon": r"dragon",        # case-sensitive, no word boundaries
+    "bee_again": r"(?i)\bbee\b",  # same keyword as "bee"
+}
+
+VOCAB = [
+    "paradise", "Safari", "SPOOKY", "summer", "bee", "Bee", "anti", "antibee", "anti bee", "Anti Bee",
+    "night", "bug", "jungle", "gem", "gems", "egg", "egg 12", "Egg3", "fire", "firefly", "fireflies",
+    "dragon", "Dragon", "dragonfly", "_bee_", "bee_", "9gem",
+    # non-ascii tokens that still hit an ascii keyword under (?i), or just look close
+    "ſafari", "ſpooky", "jungleK", "Kelvin", "bée", "beé", "İnight", "ＧＥＭ", "пчела",
+]
+SEPARATORS = [" ", "  ", ", ", "!", "\n", "-", "'", "é", ""]
+
+
+def _fuzz_text(rng: random.Random) -> str:
+    return "".join(rng.choice(VOCAB) + rng.choice(SEPARATORS) for _ in range(rng.randint(0, 12)))
+
+
+@pytest.fixture
+def patterns():
+    saved = dict(main.PATTERN_MAP)
+    for name, rx in CUSTOM_PATTERNS.items():
+        main.register_pattern(name, re.compile(rx))
+    yield main.PATTERN_MAP
+    main.PATTERN_MAP.clear()
+    main.PATTERN_MAP.update(saved)
+    main.rebuild_matcher()
+
+
+def _naive_hits(text: str):
+    hits = {name: len(rx.findall(text)) for name, rx in main.PATTERN_MAP.items()}
+    return {name: n for name, n in hits.items() if n}
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "ſafari ſafari SAFARI",
+    "jungleK Kelvin ＧＥＭ İnight",
+    "anti bee antibee bee anti  bee Anti Bee",
+    "bee_bee bee-bee _bee_",
+    "egg 12 egg3 Egg  7 eggs",
+    "fire firefly fireflies dragonfly Dragon dragon",
+])
+def test_count_hits_matches_findall(patterns, text):
+    assert main.count_hits(text) == _naive_hits(text)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_count_hits_matches_findall_fuzzed(patterns, seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        text = _fuzz_text(rng)
+        assert main.count_hits(text) == _naive_hits(text), text
+
+
+def test_anti_bee_overlap(patterns):
+    # "anti bee" is one anti_bee hit and also a bee hit, like running both regexes
+    hits = main.count_hits("anti bee")
+    assert hits["anti_bee"] == 1
+    assert hits["bee"] == 1 and hits["bee_again"] == 1
@@ -0,0 +1,12 @@
+import main
+
+
+def test_render_metrics_types():
+    text = main.render_metrics()
+    types = dict(line.split()[2:4] for line in text.splitlines() if line.startswith("# TYPE"))
+    for name in ("egg_ingest_max_depth", "egg_retention_lock_ms_max", "egg_startup_setup_s",
+                 "egg_startup_ready_s", "egg_startup_sync_s"):
+        assert types[name] == "gauge"
+    counters = [name for name, kind in types.items() if kind == "counter"]
+    assert "egg_ingest_processed_total" in counters
+    assert all(name.endswith("_total") for name in counters)
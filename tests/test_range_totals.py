@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import bench
+import main
+
+
+def _channel(times):
+    # one "gem" webhook message per time, ids made unique by their index
+    return bench.FakeTextChannel([
+        bench.FakeMessage(discord.utils.time_snowflake(t) + i, t, "gem", [], [], 1, 1)
+        for i, t in enumerate(times)], 1)
+
+
+def test_range_totals_counts_whole_hour_edges(db):
+    # messages exactly on bucket boundaries, including the last whole hour (full_hi)
+    base = datetime(2026, 10, 1, 10, tzinfo=timezone.utc)
+    times = [base + timedelta(hours=h, minutes=m) for h in range(5) for m in (0, 0, 30, 59)]
+    times.append(base + timedelta(hours=5))
+    channel = _channel(times)
+    since = base - timedelta(minutes=15)
+    before = base + timedelta(hours=5, minutes=20)
+
+    async def check():
+        scanned = await main.fast_count_all(channel, since, before)
+        first = await main.range_totals(channel, since, before)
+        again = await main.range_totals(channel, since, before)
+        return scanned["gem"], first["gem"], again["gem"]
+
+    assert db(check()) == (len(times),) * 3
+
+
+def test_range_totals_exclusive_bounds(db):
+    # (since, before) are exclusive like history(); a message on full_lo is in its bucket
+    base = datetime(2026, 10, 1, 10, tzinfo=timezone.utc)
+    times = [base, base + timedelta(hours=1), base + timedelta(hours=3)]
+    channel = _channel(times)
+
+    async def check():
+        return (await main.range_totals(channel, base, base + timedelta(hours=3)))["gem"]
+
+    assert db(check()) == 1
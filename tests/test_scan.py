@@ -0,0 +1,50 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+import discord
+import pytest
+
+import bench
+import main
+
+WORDS = ["paradise", "safari", "bee", "anti bee", "gem", "night", "hatched", "wow"]
+
+
+def _message(msg_id: int, rng: random.Random) -> bench.FakeMessage:
+    content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    return bench.FakeMessage(msg_id, discord.utils.snowflake_time(msg_id), content, [], [],
+                             4242 if rng.random() < 0.8 else None, 1)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2, 4])
+def test_fast_count_all_matches_single_pass(monkeypatch, max_workers):
+    monkeypatch.setattr(main, "SCAN_MAX_WORKERS", max_workers)
+    rng = random.Random(max_workers)
+    since = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    before = since + timedelta(hours=6)
+    lo_id = discord.utils.time_snowflake(since, high=True)
+    hi_id = discord.utils.time_snowflake(before, high=False)
+    slices = main._scan_slices(lo_id, hi_id, (before - since).total_seconds())
+    assert len(slices) == max_workers * 4
+
+    # messages right on, before and after every slice boundary, the window
+    # edges (lo_id and hi_id themselves are outside) and some in between
+    ids = {lo_id, lo_id + 1, hi_id - 1, hi_id}
+    for after, _ in slices[1:]:
+        ids.update((after, after + 1, after + 2))
+    ids.update(rng.randrange(lo_id + 1, hi_id) for _ in range(200))
+    channel = bench.FakeTextChannel([_message(i, rng) for i in ids], 1)
+
+    expected = {name: 0 for name in main.PATTERN_MAP}
+    inside = sorted(m.id for m in channel.messages if lo_id < m.id < hi_id)
+    for m in channel.messages:
+        if lo_id < m.id < hi_id:
+            for name, n in main.count_hits(main.extract_text(m)).items():
+                expected[name] += n
+
+    index_rows = []
+    totals = asyncio.run(main.fast_count_all(channel, since, before, index_rows))
+    assert totals == expected
+    # every message is fetched by exactly one slice
+    assert sorted(r[0] for r in index_rows) == inside
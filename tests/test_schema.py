@@ -0,0 +1,34 @@
+import sqlite3
+
+import main
+
+
+def test_legacy_schema_is_migrated(db):
+    conn = sqlite3.connect(main.DB_PATH)
+    conn.executescript("""
+        CREATE TABLE egg_types (name TEXT PRIMARY KEY, pattern TEXT NOT NULL, emoji TEXT);
+        CREATE TABLE egg_counts_today (egg_type TEXT PRIMARY KEY, count INTEGER NOT NULL);
+        CREATE TABLE egg_counts_daily (date TEXT NOT NULL, egg_type TEXT NOT NULL, count INTEGER NOT NULL,
+                                       PRIMARY KEY(date, egg_type));
+        INSERT INTO egg_types VALUES ('gem', '(?i)gem', NULL), ('lava', '(?i)lava', NULL);
+        INSERT INTO egg_counts_today VALUES ('gem', 4), ('lava', 2);
+        INSERT INTO egg_counts_daily VALUES ('2026-10-01', 'gem', 7), ('2026-10-01', 'lava', 3),
+                                            ('2026-10-01', 'removed', 9);
+    """)
+    conn.commit()
+    conn.close()
+
+    async def check():
+        await main.load_persisted_types()
+        names = {tid: name for tid, name in await main.db_fetchall("SELECT id, name FROM egg_types")}
+        today = await main.db_fetchall("SELECT channel_id, type_id, count FROM egg_counts_today")
+        daily = await main.db_fetchall("SELECT channel_id, date, type_id, count FROM egg_counts_daily")
+        version = (await main.db_fetchall("PRAGMA user_version"))[0][0]
+        return ({(c, names[t], n) for c, t, n in today},
+                {(c, d, names[t], n) for c, d, t, n in daily}, version)
+
+    today, daily, version = db(check())
+    assert version == main.SCHEMA_VERSION
+    assert today == {(main.CHANNEL_ID, "gem", 4), (main.CHANNEL_ID, "lava", 2)}
+    # counts of types missing from egg_types are dropped
+    assert daily == {(main.CHANNEL_ID, "2026-10-01", "gem", 7), (main.CHANNEL_ID, "2026-10-01", "lava", 3)}
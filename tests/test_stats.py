@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("offset, label", [(0, "10:00"), (5.5, "15:30"), (-3.5, "06:30"), (5.75, "15:45")])
+def test_peak_hours_use_local_bucket_start(db, monkeypatch, offset, label):
+    monkeypatch.setattr(main, "TZ_OFFSET", offset)
+    bucket = datetime(2026, 10, 1, 10, tzinfo=timezone.utc).timestamp()
+    today_start = datetime(2026, 10, 3, tzinfo=timezone.utc)
+
+    async def check():
+        await main.db_execute("INSERT INTO egg_counts_hourly(channel_id, bucket_start, type_id, count, webhook_count) "
+                              "VALUES(1, ?, ?, 5, 5)", (bucket, main.type_id("gem")))
+        return await main.compute_stats(SimpleNamespace(channel_id=1), today_start)
+
+    assert db(check())["hours"] == [(5, label)]